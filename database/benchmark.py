@@ -0,0 +1,430 @@
+"""Benchmarks of the database package,
+DATABASE_URL must point to a database, which can be spoiled, without it
+a throwaway server is started by initdb and pg_ctl from DATABASE_PG_BIN or PATH
+
+    python benchmark.py insert [rows]
+    python benchmark.py grouping [rows]
+    python benchmark.py tables [tables]
+    python benchmark.py trade [clients] [purchases]
+    python benchmark.py update [rows]
+    python benchmark.py suite [tables] [clients] [selects]
+    python benchmark.py pool [clients] [queries]
+
+The suite prints results as JSON with sorted keys, which can be compared across commits,
+and writes them to DATABASE_BENCHMARK_OUTPUT
+"""
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict, namedtuple
+from contextlib import contextmanager, nullcontext
+from typing import AsyncIterator, Awaitable, Callable, Iterator
+
+import functions
+import init
+from functions import copy_records, execute, executemany, fetchone
+from constraints import Trade
+from fields import TablesAttitude as TA
+from meta import MetaTable, association
+from predicates import Lt
+from stats import CallStats
+from table import Table
+
+
+class BenchItem(Table):
+    name: str
+    price: int
+    weight: float
+
+class BenchCountry(Table):
+    name: str
+    balance: int
+    wares: list['BenchWare']
+
+class BenchWare(Table):
+    name: str
+    price: int
+    weight: float
+    bench_country: BenchCountry
+
+class BenchInventory(Table):
+    bench_country: BenchCountry
+    bench_item: BenchItem
+    count: int
+    __constraints__ = (Trade('bench_country', 'bench_item'),)
+
+def _rows(count: int) -> list[dict]:
+    return [{'name': f'item {n}', 'price': n, 'weight': n/3} for n in range(count)]
+
+async def _recreate(*tables: Table):
+    for table in reversed(tables):
+        await execute(f'DROP TABLE IF EXISTS {table.table}')
+    for table in tables:
+        fields = [f'{table.table}_id INT GENERATED ALWAYS AS IDENTITY PRIMARY KEY']
+        fields += [str(field) for field in table.fields.values() 
+                   if field.attitude not in (TA.OneToMany, TA.ManyToMany)]
+        await execute(f'CREATE TABLE {table.table}({", ".join(fields)})')
+
+async def _timeit(name: str, func: Callable[[], Awaitable], count: int):
+    start = time.perf_counter()
+    await func()
+    elapsed = time.perf_counter()-start
+    print(f'{name:<16} {elapsed:8.3f}s {count/elapsed:12.0f} rows/s')
+
+async def _memit(name: str, func: Callable[[], Awaitable], count: int):
+    tracemalloc.start()
+    start = time.perf_counter()
+    await func()
+    elapsed = time.perf_counter()-start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f'{name:<16} {elapsed:8.3f}s {count/elapsed:12.0f} rows/s {peak/2**20:8.1f} MiB peak')
+
+
+async def insert(count: int = 10_000):
+    rows = _rows(count)
+    columns = ', '.join(BenchItem.fields)
+    query = f'INSERT INTO {BenchItem.table}({columns}) VALUES($1, $2, $3)'
+
+    async def row_by_row():
+        for row in rows:
+            await BenchItem.insert(**row)
+    async def many():
+        await executemany(query, [tuple(row.values()) for row in rows])
+    async def copy():
+        await BenchItem.insert_many(rows)
+
+    for name, func in (('row by row', row_by_row), ('executemany', many), ('copy', copy)):
+        await _recreate(BenchItem)
+        await _timeit(name, func, count)
+    await execute(f'DROP TABLE {BenchItem.table}')
+
+async def grouping(count: int = 100_000):
+    """Grouping of joined rows by positions of columns against grouping by names"""
+    await _recreate(BenchCountry, BenchWare)
+    countries = await BenchCountry.insert_many(
+            ({'name': f'country {n}', 'balance': n} for n in range(count//100)), 
+            returning='bench_country_id'
+    )
+    await BenchWare.insert_many(
+            {**row, 'bench_country': countries[n%len(countries)]['bench_country_id']}
+            for n, row in enumerate(_rows(count))
+    )
+    plan, _ = BenchCountry._plan('name balance wares', (), {})
+    output = await functions.fetch(plan.query)
+
+    async def by_names():
+        _group_by_names(plan, output)
+    async def keys_handle():
+        BenchCountry._keys_handle(plan, output)
+    async def columns():
+        await BenchCountry.select_columns('name balance wares')
+    await _memit('grouping names', by_names, count)
+    await _memit('grouping', keys_handle, count)
+    await _memit('columnar select', columns, count)
+    for table in (BenchWare, BenchCountry):
+        await execute(f'DROP TABLE {table.table}')
+
+def _group_by_names(plan, output) -> dict:
+    """Grouping before positions of columns: records are created for every select
+    and rows are copied through dicts, it's the baseline of grouping"""
+    KeyRecord = namedtuple('Record', plan.keys)
+    RowRecord = namedtuple('Record', [c for c in plan.columns if c not in plan.keys])
+    output_ = defaultdict(list)
+    for row in output:
+        row = dict(row)
+        key = KeyRecord(*(row.pop(key) for key in plan.keys))
+        output_[key].append(RowRecord(*row.values()))
+    return dict(output_)
+
+async def tables(count: int = 800):
+    """Creation of linked tables, the time per table mustn't grow with count"""
+    for size in (count//8, count//4, count//2, count):
+        start = time.perf_counter()
+        _generate(size, f'Generated{size}_')
+        elapsed = time.perf_counter()-start
+        print(f'{size:>6} tables {elapsed:8.3f}s {elapsed/size*1e6:10.1f} us/table')
+
+def _generate(count: int, prefix: str) -> list[Table]:
+    """Every table refers to the previous one and to the next one by string"""
+    tables = []
+    for n in range(count):
+        annotations = {'name': str, 'price': int, 'weight': float}
+        if n+1 < count:
+            annotations['wares'] = list[f'{prefix}{n+1}']
+        if tables:
+            annotations['owner'] = tables[-1]
+        namespace = {'__annotations__': annotations, '__module__': __name__}
+        tables.append(MetaTable(f'{prefix}{n}', (Table,), namespace))
+    return tables
+
+async def trade(clients: int = 50, purchases: int = 100):
+    """Concurrent purchases by reading and writing rows from Python against 
+    the server function, money of countries and prices of their items must be constant"""
+    countries, items = 10, 20
+    async def naive(country: int, item: int):
+        balance = (await fetchone('SELECT balance FROM bench_country '
+                                  'WHERE bench_country_id = $1', country))['balance']
+        price = (await fetchone('SELECT price FROM bench_item '
+                                'WHERE bench_item_id = $1', item))['price']
+        if balance < price: return
+        await execute('UPDATE bench_country SET balance = $2 WHERE bench_country_id = $1',
+                      country, balance-price)
+        await execute('INSERT INTO bench_inventory(bench_country_id, bench_item_id, count) '
+                      'VALUES($1, $2, 1) ON CONFLICT(bench_country_id, bench_item_id) '
+                      'DO UPDATE SET count = bench_inventory.count + 1', country, item)
+    async def server(country: int, item: int):
+        await BenchInventory.purchase(country, item)
+
+    for name, purchase in (('read and write', naive), ('server function', server)):
+        await _recreate(BenchCountry, BenchItem, BenchInventory)
+        name_, unique = BenchInventory.__constraints__[0].constraint
+        await execute(f'ALTER TABLE bench_inventory ADD CONSTRAINT {name_} {unique}')
+        for function in BenchInventory.__constraints__[0].functions(BenchInventory).values():
+            await execute(function)
+        await BenchCountry.insert_many({'name': f'country {n}', 'balance': 10_000} 
+                                       for n in range(countries))
+        await BenchItem.insert_many({'name': f'item {n}', 'price': n+1, 'weight': 1.0} 
+                                    for n in range(items))
+        money = await _money()
+
+        async def client(seed: int):
+            random_ = random.Random(seed)
+            for _ in range(purchases):
+                await purchase(random_.randint(1, countries), random_.randint(1, items))
+        await _timeit(name, lambda: asyncio.gather(*map(client, range(clients))),
+                      clients*purchases)
+        after = await _money()
+        print(f'{"":<16} money {money} before, {after} after')
+        if purchase is server:
+            bought = (await fetchone('SELECT sum(count) AS count FROM bench_inventory'))['count']
+            assert bought, 'nothing was bought'
+            assert after == money, f'money of countries changed from {money} to {after}'
+    for table in (BenchInventory, BenchItem, BenchCountry):
+        await execute(f'DROP TABLE {table.table}')
+
+async def _money() -> int:
+    return (await fetchone(
+            'SELECT (SELECT sum(balance) FROM bench_country)+'
+            'COALESCE((SELECT sum(count*price) FROM bench_inventory '
+            'JOIN bench_item USING(bench_item_id)), 0) AS money'
+    ))['money']
+
+async def update(count: int = 10_000):
+    """Updates and deletes of rows by their ids with executemany against unnest and ANY"""
+    ids = list(range(1, count+1))
+    async def many_update():
+        await executemany(f'UPDATE {BenchItem.table} SET price = $2, weight = $3 '
+                          f'WHERE bench_item_id = $1', [(id, id*2, id/7) for id in ids])
+    async def unnest_update():
+        updated = await BenchItem.update_many({'bench_item_id': id, 'price': id*2, 'weight': id/7} 
+                                              for id in ids)
+        assert updated == count, updated
+    async def many_delete():
+        await executemany(f'DELETE FROM {BenchItem.table} WHERE bench_item_id = $1', 
+                          [(id,) for id in ids])
+    async def any_delete():
+        deleted = await BenchItem.delete_many(ids)
+        assert deleted == count, deleted
+
+    for name, func in (('executemany', many_update), ('update unnest', unnest_update),
+                       ('executemany', many_delete), ('delete any', any_delete)):
+        await _recreate(BenchItem)
+        await BenchItem.insert_many(_rows(count))
+        await _timeit(name, func, count)
+    await execute(f'DROP TABLE {BenchItem.table}')
+
+async def suite(count: int = 20, clients: int = 32, selects: int = 200):
+    """End-to-end measurements on generated schema of count item tables,
+    which are linked with countries by OneToMany and ManyToMany fields in turn"""
+    countries, rows = 100, 1000
+    results = {'parameters': {'tables': count, 'clients': clients, 'selects': selects,
+                              'countries': countries, 'rows': rows}}
+    results['environment'] = {'commit': _commit(), 'python': platform.python_version(),
+                              'postgres': (await fetchone('SHOW server_version'))['server_version']}
+    metrics = results['metrics'] = {}
+    metrics['import_ms'] = _import_time()
+
+    start = time.perf_counter()
+    country, items = _generate_suite(count, 'Suite')
+    metrics['meta_us_per_table'] = (time.perf_counter()-start)/(count+1)*1e6
+
+    start = time.perf_counter()
+    assert await init._create_tables(force=True) is not None, 'schema is not created'
+    metrics['schema_create_s'] = time.perf_counter()-start
+    start = time.perf_counter()
+    assert await init._create_tables() == '', 'schema is changed after creation'
+    metrics['schema_unchanged_ms'] = (time.perf_counter()-start)*1e3
+
+    ids = [row[f'{country.table}_id'] for row in await country.insert_many(
+           ({'name': f'country {n}', 'balance': n} for n in range(countries)),
+           returning=f'{country.table}_id')]
+    for n, item in enumerate(items):
+        if n%2 == 0:
+            await item.insert_many({**row, country.table: ids[i%countries]} 
+                                   for i, row in enumerate(_rows(rows)))
+            continue
+        item_ids = [row[f'{item.table}_id'] for row in 
+                    await item.insert_many(_rows(rows), returning=f'{item.table}_id')]
+        await copy_records(association(country, item), 
+                           [f'{country.table}_id', f'{item.table}_id'],
+                           _aiter([[(ids[i%countries], id) for i, id in enumerate(item_ids)]]))
+
+    stats = CallStats()
+    async def client(seed: int):
+        random_ = random.Random(seed)
+        for _ in range(selects):
+            n = random_.randrange(count)
+            start = time.perf_counter_ns()
+            if random_.random() < 0.5:
+                output = await items[n].select('name price', price=Lt(random_.randrange(rows)//10))
+            else:
+                output = await country.select(f'name balance items{n}', 
+                                              name=f'country {random_.randrange(countries)}')
+            stats.add(time.perf_counter_ns()-start, error=output is None)
+    start = time.perf_counter()
+    await asyncio.gather(*map(client, range(clients)))
+    metrics['select_per_s'] = clients*selects/(time.perf_counter()-start)
+    metrics['select_errors'] = stats.errors
+    for p in (50, 95, 99):
+        metrics[f'select_p{p}_ms'] = stats.percentile(p)*1e3
+
+    for name, select in (('select', lambda: items[0].select('name price weight')),
+                         ('select_columns', lambda: items[0].select_columns('name price weight')),
+                         ('select_nested', lambda: country.select_nested('name items0 items1'))):
+        tracemalloc.start()
+        assert await select() is not None, f'{name} failed'
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        metrics[f'{name}_bytes_per_row'] = peak/(rows*2 if name == 'select_nested' else rows)
+
+    tables = [*init._schemas(Table.subtables()), 'schema_fingerprint']
+    await execute(f'DROP TABLE IF EXISTS {", ".join(tables)} CASCADE')
+    output = json.dumps(results, indent=2, sort_keys=True)
+    print(output)
+    if path := os.getenv('DATABASE_BENCHMARK_OUTPUT'):
+        with open(path, 'w') as file:
+            file.write(output)
+
+def _generate_suite(count: int, prefix: str) -> tuple[Table, list[Table]]:
+    """Even item tables are owned by countries, odd ones are linked with them by ManyToMany"""
+    annotations = {'name': str, 'balance': int}
+    annotations |= {f'items{n}': list[f'{prefix}Item{_word(n)}'] for n in range(count)}
+    namespace = {'__annotations__': annotations, '__module__': __name__}
+    country = MetaTable(f'{prefix}Country', (Table,), namespace)
+    items = []
+    for n in range(count):
+        annotations = {'name': str, 'price': int, 'weight': float}
+        if n%2 == 0:
+            annotations[country.table] = country
+        else:
+            annotations['countries'] = list[country]
+        namespace = {'__annotations__': annotations, '__module__': __name__}
+        items.append(MetaTable(f'{prefix}Item{_word(n)}', (Table,), namespace))
+    return country, items
+
+def _word(number: int) -> str:
+    """Names of tables are made only of words, so numbers are written by letters"""
+    letters = ''
+    while True:
+        number, letter = divmod(number, 26)
+        letters = chr(ord('a')+letter)+letters
+        if not number: return 'N'+letters
+
+def _import_time(repeat: int = 5) -> float:
+    """Returns median time of import of the package by new interpreters in ms"""
+    code = 'import time; start = time.perf_counter(); import init; '\
+           'print((time.perf_counter()-start)*1e3)'
+    directory = os.path.dirname(os.path.abspath(__file__))
+    return statistics.median(
+            float(subprocess.run([sys.executable, '-c', code], cwd=directory, check=True,
+                                 capture_output=True, text=True).stdout.split()[-1])
+            for _ in range(repeat)
+    )
+
+def _commit() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+async def _aiter(chunks: list) -> AsyncIterator:
+    for chunk in chunks:
+        yield chunk
+
+@contextmanager
+def _postgres() -> Iterator[str]:
+    """Starts a throwaway server in a temporary directory and returns its url,
+    the server listens only its unix socket and is removed at the end"""
+    binaries = os.getenv('DATABASE_PG_BIN')
+    initdb, pg_ctl = (os.path.join(binaries, name) if binaries else shutil.which(name)
+                      for name in ('initdb', 'pg_ctl'))
+    if not initdb or not pg_ctl:
+        raise ValueError("I can't find initdb and pg_ctl, set DATABASE_PG_BIN or DATABASE_URL")
+    directory = tempfile.mkdtemp(prefix='wpg-benchmark-')
+    data = os.path.join(directory, 'data')
+    try:
+        subprocess.run([initdb, '-D', data, '-U', 'postgres', '-A', 'trust'], 
+                       check=True, stdout=subprocess.DEVNULL)
+        subprocess.run([pg_ctl, '-D', data, '-l', os.path.join(directory, 'log'), '-w', 
+                        '-o', f"-k {directory} -c listen_addresses=''", 'start'], 
+                       check=True, stdout=subprocess.DEVNULL)
+        yield f'postgresql://postgres@/postgres?host={directory}'
+    finally:
+        if os.path.exists(os.path.join(data, 'postmaster.pid')):
+            subprocess.run([pg_ctl, '-D', data, '-m', 'fast', '-w', 'stop'], 
+                           stdout=subprocess.DEVNULL)
+        shutil.rmtree(directory, ignore_errors=True)
+
+async def pool(clients: int = 50, queries: int = 20):
+    """Clients wait for connections of the pool, which is smaller than them,
+    close_pool drains acquired connections and terminates them after timeout"""
+    acquires, peak = functions.pool_stats().acquire.calls, 0
+    async def client():
+        nonlocal peak
+        for _ in range(queries):
+            await fetchone('SELECT pg_sleep(0.001)')
+            peak = max(peak, functions.pool_stats().waiters)
+    await _timeit('waiting clients', lambda: asyncio.gather(*(client() for _ in range(clients))),
+                  clients*queries)
+    stats = functions.pool_stats()
+    print(f'{"":<16} size {stats.size}/{stats.max_size}, peak of waiters {peak}, '
+          f'acquire p99 {stats.acquire.percentile(99)*1e3:.3f} ms')
+    assert stats.size <= stats.max_size and stats.waiters == 0
+    assert stats.acquire.calls-acquires == clients*queries
+    assert peak > 0 or clients <= stats.max_size, 'clients didn\'t wait for connections'
+
+    for name, sleep, timeout in (('drain', 0.2, 5), ('terminate', 5, 0.2)):
+        query = asyncio.ensure_future(functions.pool().fetchval(f'SELECT pg_sleep({sleep})'))
+        await asyncio.sleep(0.05)
+        start = time.perf_counter()
+        await functions.close_pool(timeout)
+        elapsed = time.perf_counter()-start
+        error = (await asyncio.gather(query, return_exceptions=True))[0]
+        print(f'{name:<16} {elapsed:8.3f}s query {type(error).__name__}')
+        assert (error is None) == (name == 'drain') and elapsed < min(sleep, timeout)+1
+        await functions.init_pool()
+
+benchmarks = {'insert': insert, 'grouping': grouping, 'tables': tables, 'trade': trade,
+              'update': update, 'suite': suite, 'pool': pool}
+async def main(name: str, *args: str):
+    with nullcontext(functions.url) if functions.url else _postgres() as url:
+        functions.url = url
+        await functions.init_pool()
+        try:
+            await benchmarks[name](*map(int, args))
+        finally:
+            await functions.close_pool()
+
+if __name__ == '__main__':
+    asyncio.run(main(*sys.argv[1:]))
@@ -0,0 +1,187 @@
+"""Read-through cache of selects of tables, which declare __cache__.
+Triggers notify about writes to tables, entries of caches, which read the table,
+are evicted by the listener connection of the worker
+
+    class Item(Table):
+        name: str
+        price: int
+        __cache__ = Cache(size=1000, ttl=60)
+"""
+import asyncio
+import logging
+import sys
+import time
+from collections import OrderedDict, defaultdict, namedtuple
+from typing import Any, Hashable, Iterable
+
+import asyncpg
+
+import functions
+from meta import Table, association
+from fields import TablesAttitude as TA
+
+
+channel = 'wpg_cache'
+# logger imports tables, which import the cache
+debug_logger = logging.getLogger('debugLogger')
+CacheStats = namedtuple('CacheStats', 'hits misses evictions size memory hit_ratio')
+class Cache:
+    """LRU of outputs of selects bounded by count of entries and their age in seconds,
+    memory is approximate size of cached rows in bytes"""
+    def __init__(self, size: int = 1000, ttl: float = 60):
+        self.size, self.ttl = size, ttl
+        self.entries: OrderedDict[Hashable, tuple[float, int, Any]] = OrderedDict()
+        self.hits = self.misses = self.evictions = self.memory = 0
+        self.generation = 0
+
+    def get(self, key: Hashable) -> Any | None:
+        entry = self.entries.get(key)
+        if entry and entry[0] < time.monotonic():
+            self._pop(key)
+            entry = None
+        if not entry:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[2]
+
+    def put(self, key: Hashable, value: Any, generation: int):
+        """Value isn't put if the cache was cleared since the generation,
+        because it could be read before the write"""
+        if generation != self.generation:
+            return
+        if key in self.entries:
+            self._pop(key)
+        memory = _sizeof(value)
+        self.entries[key] = time.monotonic()+self.ttl, memory, value
+        self.memory += memory
+        while len(self.entries) > self.size:
+            self._pop(next(iter(self.entries)))
+            self.evictions += 1
+
+    def clear(self):
+        self.evictions += len(self.entries)
+        self.entries.clear()
+        self.memory = 0
+        self.generation += 1
+
+    def info(self) -> CacheStats:
+        requests = self.hits+self.misses
+        return CacheStats(self.hits, self.misses, self.evictions, len(self.entries),
+                          self.memory, self.hits/requests if requests else 0.0)
+
+    def _pop(self, key: Hashable):
+        self.memory -= self.entries.pop(key)[1]
+
+    def __repr__(self) -> str:
+        return f'Cache(size={self.size}, ttl={self.ttl})'
+
+def _sizeof(rows: list) -> int:
+    return sys.getsizeof(rows)+sum(sys.getsizeof(row)+sum(map(sys.getsizeof, row))
+                                   for row in rows)
+
+def key(query: str, values: list[Any]) -> Hashable | None:
+    """Returns key of the select or None if its values can't be hashed"""
+    key = query, tuple(tuple(v) if isinstance(v, list) else v for v in values)
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+def tables(table: Table) -> set[str]:
+    """Returns names of tables, which selects of the table can read"""
+    names = {table.table}
+    for field in table.fields.values():
+        if field.attitude is TA.Simple: continue
+        names.add(field.type.table)
+        if field.attitude is TA.ManyToMany:
+            names.add(association(table, field.type))
+    return names
+
+def trigger(table: str) -> str:
+    """Returns definition of the trigger, which notifies about writes to the table,
+    the trigger is dropped and created, because CREATE OR REPLACE TRIGGER needs PostgreSQL 14"""
+    return f'''CREATE OR REPLACE FUNCTION {table}_notify() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN PERFORM pg_notify('{channel}', '{table}'); RETURN NULL; END $$;
+DROP TRIGGER IF EXISTS {table}_notify ON {table};
+CREATE TRIGGER {table}_notify
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table}
+FOR EACH STATEMENT EXECUTE FUNCTION {table}_notify()'''
+
+
+_dependents: defaultdict[str, list[Cache]] = defaultdict(list)
+_listener: asyncpg.Connection | None = None
+_reconnection: asyncio.Task | None = None
+max_delay: float = 30
+def listening() -> bool:
+    """Caches are used only while the listener is connected,
+    otherwise workers could miss writes of each other"""
+    return _listener is not None
+
+async def listen(tables_: Iterable[Table]):
+    """Connects the listener and links caches with tables, which they read"""
+    _dependents.clear()
+    for table in tables_:
+        if cache := getattr(table, '__cache__', None):
+            for name in tables(table):
+                _dependents[name].append(cache)
+    if _listener is None and _reconnection is None:
+        await _connect()
+
+async def unlisten():
+    global _listener, _reconnection
+    if _reconnection is not None:
+        _reconnection.cancel()
+        _reconnection = None
+    if _listener is not None:
+        listener, _listener = _listener, None
+        await listener.close()
+    _clear()
+
+def evict(table: str):
+    for cache in _dependents.get(table, ()):
+        cache.clear()
+
+async def _connect():
+    global _listener
+    listener = await asyncpg.connect(functions.url)
+    listener.add_termination_listener(_terminated)
+    await listener.add_listener(channel, lambda conn, pid, channel, table: evict(table))
+    _listener = listener
+
+def _terminated(conn: asyncpg.Connection):
+    """Caches are cleared and aren't used until the listener is reconnected,
+    because notifications of writes are lost meanwhile"""
+    global _listener, _reconnection
+    if conn is not _listener: return
+    _listener = None
+    _clear()
+    _reconnection = asyncio.get_running_loop().create_task(_reconnect())
+
+async def _reconnect():
+    """Reconnects the listener with exponential backoff up to max_delay seconds"""
+    global _reconnection
+    delay = 0.1
+    while True:
+        await asyncio.sleep(delay)
+        try:
+            await _connect()
+        except (OSError, asyncpg.PostgresError) as e:
+            debug_logger.warning('Listener of caches is not reconnected: %s', e)
+            delay = min(delay*2, max_delay)
+        else:
+            break
+    _reconnection = None
+    _clear()
+
+def _clear():
+    for caches in _dependents.values():
+        for cache in caches:
+            cache.clear()
+
+def cache_stats() -> dict[str, CacheStats]:
+    return {table.table: table.__cache__.info() for table in Table.subtables()
+            if getattr(table, '__cache__', None)}
@@ -1,6 +1,7 @@
-from typing import Protocol, TypeAlias, runtime_checkable
+import re
+from typing import Iterable, Protocol, TypeAlias, runtime_checkable
 
-from fields import Field
+from fields import Field, identifier
 
 
 name: TypeAlias = str
@@ -24,3 +25,216 @@ class Unique(list):
     def __repr__(self) -> str:
         fields = ', '.join(field.name for field in self)
         return f'Unique({fields})'
+
+class Index:
+    """Index of the table, columns are fields or SQL expressions,
+    it isn't a constraint, so constraint is empty
+
+        Index(Field('name'))
+        Index('lower(name)', method='hash')
+        Index(Field('price'), include=(Field('name'),), where='price > 0')"""
+    methods = ('btree', 'hash', 'gin', 'gist', 'brin')
+
+    def __init__(self, *columns: Field | str, method: str = 'btree', 
+                 include: Iterable[Field] = (), where: str = None, name: str = None):
+        if not columns:
+            raise ValueError("I can't create index without columns")
+        if method not in self.methods:
+            raise ValueError(f"I can't create index with method {method}")
+        self.columns, self.method, self.include = columns, method, tuple(include)
+        self.where, self.name = where, name
+
+    @property
+    def constraint(self) -> constraint | list[constraint]:
+        return []
+
+    @property
+    def index(self) -> constraint:
+        """Returns name and definition of index after the name of table"""
+        columns = [c.name if isinstance(c, Field) else f'({c})' for c in self.columns]
+        name = self.name or \
+               '_'.join(re.sub(r'\W+', '_', c).strip('_') for c in columns)+'_idx'
+        definition = f'USING {self.method}({", ".join(columns)})'
+        if self.include:
+            definition += f' INCLUDE({", ".join(field.name for field in self.include)})'
+        if self.where:
+            definition += f' WHERE {self.where}'
+        return name, definition
+
+    def __repr__(self) -> str:
+        return f'Index({self.index[1]})'
+
+class Partition:
+    """Partitioning of the table by the field, it isn't a constraint, so constraint is empty.
+    Range partitions have width of step from start and are attached ahead of the max key,
+    rows beyond them and out of values of list are kept in the default partition.
+    Unique constraints of the table must include the field
+
+        Partition(Field('turn'), 'range', step=10, ahead=2)
+        Partition(Field('kind'), 'list', values=('army', 'fleet'))
+        Partition(Field('country_id'), 'hash', modulus=8)"""
+    methods = ('range', 'list', 'hash')
+
+    def __init__(self, field: Field | str, method: str = 'range', *, step=None, start=0,
+                 ahead: int = 2, values: Iterable = (), modulus: int = None):
+        if method not in self.methods:
+            raise ValueError(f"I can't partition by method {method}")
+        elif method == 'range' and not step:
+            raise ValueError("I can't partition by range without step")
+        elif method == 'list' and not values:
+            raise ValueError("I can't partition by list without values")
+        elif method == 'hash' and not modulus:
+            raise ValueError("I can't partition by hash without modulus")
+        self._field = field
+        self.method, self.step, self.start, self.ahead = method, step, start, ahead
+        self.values, self.modulus = tuple(values), modulus
+
+    @property
+    def constraint(self) -> constraint | list[constraint]:
+        return []
+
+    @property
+    def field(self) -> str:
+        """Name of field is read lazily, because fields of the class body get names later"""
+        return self._field.name if isinstance(self._field, Field) else self._field
+
+    @property
+    def partition(self) -> str:
+        return f'{self.method.upper()}({self.field})'
+
+    def partitions(self, table: str, last=None, first=None) -> dict[name, tuple[str, str | None]]:
+        """Returns names of partitions with their bounds and conditions of their rows,
+        range partitions are returned from the partition of first key to ahead ones 
+        after the partition of last key, so old partitions can be dropped 
+        and aren't created again"""
+        match self.method:
+            case 'hash':
+                return {identifier(f'{table}_p{n}'): 
+                        (f'FOR VALUES WITH (MODULUS {self.modulus}, REMAINDER {n})', None)
+                        for n in range(self.modulus)}
+            case 'list':
+                partitions = {
+                    identifier(f'{table}_{_suffix(value)}'):
+                    (f'FOR VALUES IN ({_literal(value)})', f'{self.field} = {_literal(value)}')
+                    for value in self.values
+                }
+            case 'range':
+                number = lambda key: max((key-self.start)//self.step, 0) if key is not None else 0
+                last = number(last)
+                partitions = {}
+                for n in range(min(number(first), last) if first is not None else last, 
+                               last+self.ahead+1):
+                    low, high = map(_literal, (self.start+n*self.step, self.start+(n+1)*self.step))
+                    partitions[identifier(f'{table}_p{n}')] = \
+                        (f'FOR VALUES FROM ({low}) TO ({high})',
+                         f'{self.field} >= {low} AND {self.field} < {high}')
+        partitions[self.default(table)] = 'DEFAULT', None
+        return partitions
+
+    @staticmethod
+    def default(table: str) -> name:
+        return identifier(f'{table}_default')
+
+    def attach(self, table: str, name: str, bound: str, where: str | None) -> list[str]:
+        """Returns statements, which create the partition aside and attach it,
+        so the table isn't locked exclusively, rows of the partition are moved 
+        from the default one before"""
+        statements = [f'CREATE TABLE IF NOT EXISTS {name}'
+                      f'(LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)']
+        if where:
+            statements.append(f'WITH moved AS (DELETE FROM {self.default(table)} WHERE {where} '
+                              f'RETURNING *) INSERT INTO {name} SELECT * FROM moved')
+        return statements+[f'ALTER TABLE {table} ATTACH PARTITION {name} {bound}']
+
+    def __repr__(self) -> str:
+        return f'Partition({self.partition})'
+
+def _suffix(value) -> str:
+    return re.sub(r'\W+', '_', str(value)).strip('_').lower()
+
+def _literal(value) -> str:
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    value = value.isoformat() if hasattr(value, 'isoformat') else str(value)
+    return "'"+value.replace("'", "''")+"'"
+
+class Trade:
+    """Constraint of the inventory, which links countries with items and counts them,
+    generates server functions of purchase, sell and consumption of items,
+    which change balance of the country and count of the item in one statement
+
+        class Inventory(Table):
+            country: Country
+            item: Item
+            count: int
+            __constraints__ = (Trade('country', 'item'),)
+
+        await Inventory.purchase(country_id, item_id, 3)"""
+    def __init__(self, country: str, item: str, count: str = 'count',
+                 price: str = 'price', balance: str = 'balance'):
+        self.country, self.item, self.count = country, item, count
+        self.price, self.balance = price, balance
+
+    @property
+    def constraint(self) -> constraint | list[constraint]:
+        return 'trade', f'UNIQUE({self.country}_id, {self.item}_id)'
+
+    def functions(self, table) -> dict[name, str]:
+        """Returns definitions of functions of the inventory table"""
+        country, item = table.fields[self.country], table.fields[self.item]
+        count = table.fields[self.count]
+        balance = country.type.fields[self.balance]
+        price = item.type.fields[self.price]
+        names = dict(
+                inventory=table.table, country=country.type.table, item=item.type.table,
+                country_id=country.name, item_id=item.name, count=count.name,
+                balance=balance.name, price=price.name
+        )
+        functions = {}
+        for action, query in _trade_queries.items():
+            returns = f'count {count.sql_type}'
+            if action != 'consume':
+                returns = f'balance {balance.sql_type}, '+returns
+            name = f'{table.table}_{action}'
+            functions[name] = f'CREATE OR REPLACE FUNCTION {name}(INT, INT, {count.sql_type}) '\
+                              f'RETURNS TABLE({returns}) LANGUAGE sql AS $$\n'\
+                              f'{query.format(**names)}$$'
+        return functions
+
+    def __repr__(self) -> str:
+        return f'Trade({self.country}, {self.item})'
+
+_trade_queries = {
+    'purchase': '''WITH paid AS (
+    UPDATE {country} SET {balance} = {country}.{balance} - {item}.{price}*$3
+    FROM {item} 
+    WHERE {country}.{country}_id = $1 AND {item}.{item}_id = $2 AND $3 > 0
+      AND {country}.{balance} >= {item}.{price}*$3
+    RETURNING {country}.{balance}
+), stored AS (
+    INSERT INTO {inventory}({country_id}, {item_id}, {count}) SELECT $1, $2, $3 FROM paid
+    ON CONFLICT({country_id}, {item_id}) 
+    DO UPDATE SET {count} = {inventory}.{count} + excluded.{count}
+    RETURNING {inventory}.{count}
+)
+SELECT paid.{balance}, stored.{count} FROM paid, stored
+''',
+    'sell': '''WITH taken AS (
+    UPDATE {inventory} SET {count} = {inventory}.{count} - $3
+    WHERE {inventory}.{country_id} = $1 AND {inventory}.{item_id} = $2 AND $3 > 0
+      AND {inventory}.{count} >= $3
+    RETURNING {inventory}.{count}
+), paid AS (
+    UPDATE {country} SET {balance} = {country}.{balance} + {item}.{price}*$3
+    FROM {item}, taken
+    WHERE {country}.{country}_id = $1 AND {item}.{item}_id = $2
+    RETURNING {country}.{balance}
+)
+SELECT paid.{balance}, taken.{count} FROM paid, taken
+''',
+    'consume': '''UPDATE {inventory} SET {count} = {inventory}.{count} - $3
+WHERE {inventory}.{country_id} = $1 AND {inventory}.{item_id} = $2 AND $3 > 0
+  AND {inventory}.{count} >= $3
+RETURNING {inventory}.{count}
+'''
+}
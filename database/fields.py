@@ -1,3 +1,4 @@
+import hashlib
 from enum import Enum
 from dataclasses import dataclass, fields
 from typing import Literal
@@ -10,7 +11,7 @@ class TablesAttitude(Enum):
     ManyToOne = 'Table and list[Table]'
     ManyToMany = 'list[Table] and list[Table]'
 
-@dataclass
+@dataclass(frozen=True)
 class Sequence:
     start: int = 1
     increment: int = 1
@@ -19,26 +20,25 @@ class Sequence:
 
     def __repr__(self) -> str:
         seq = f'start {self.start} increment {self.increment}'
-        seq += f' max {self.max}' if self.max else ''
-        seq += f' min {self.min}' if self.min else ''
+        seq += f' maxvalue {self.max}' if self.max is not None else ''
+        seq += f' minvalue {self.min}' if self.min is not None else ''
         return seq
 
-@dataclass
+@dataclass(frozen=True)
 class Generated:
     generation: Literal['ALWAYS'] | Literal['BY DEFAULT'] = 'ALWAYS'
     type: Literal['IDENTITY'] | Literal['STORED'] = 'IDENTITY'
     options: str | Sequence = ''
 
     def __post_init__(self):
-        if self.type == 'IDENTITY':
-            self.options = Sequence()
-        self.options = '('+str(self.options)+')' if self.options else ''
+        if self.type == 'IDENTITY' and not self.options:
+            self.__dict__['options'] = Sequence()
 
     def __repr__(self) -> str:
         if self.type == 'IDENTITY':
-            return f'GENERATED {self.generation} AS IDENTITY {self.options}'
+            return f'GENERATED {self.generation} AS IDENTITY ({self.options})'
         else:
-            return f'GENERATED {self.generation} AS {self.options} STORED'
+            return f'GENERATED {self.generation} AS ({self.options}) STORED'
 
 Table = type
 @dataclass(frozen=True)
@@ -69,3 +69,12 @@ class Field:
             if getattr(self, key) != getattr(other, key):
                 differences[key] = getattr(self, key)
         return differences
+
+
+def identifier(name: str) -> str:
+    """The database truncates names to 63 bytes, so long names are shortened 
+    with hash of the whole name, otherwise they would differ from created ones
+    or would be equal after truncation"""
+    if len(name.encode()) <= 63:
+        return name
+    return name.encode()[:54].decode(errors='ignore')+'_'+hashlib.md5(name.encode()).hexdigest()[:8]
@@ -1,8 +1,19 @@
 import asyncio
+import importlib
+import itertools
+import json
 import os
-from typing import Any, Mapping, Sequence, TypeAlias
+import time
+from collections import OrderedDict, defaultdict
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, AsyncIterable, AsyncIterator, Callable, Mapping, Sequence, TypeAlias
 
 import asyncpg
+from asyncpg.prepared_stmt import PreparedStatement
+
+from stats import CallStats
 
 
 _pool: asyncpg.Pool = ...
@@ -10,27 +21,347 @@ def pool() -> asyncpg.Pool:
     return _pool
 Row: TypeAlias = Mapping[str, Any]
 url: str = os.getenv('DATABASE_URL')
+prepared: int = int(os.getenv('DATABASE_PREPARED_STATEMENTS', 0))
+max_size: int = int(os.getenv('DATABASE_POOL_MAX_SIZE', 10))
+min_size: int = int(os.getenv('DATABASE_POOL_MIN_SIZE', min(10, max_size)))
+statement_cache_size: int = int(os.getenv('DATABASE_STATEMENT_CACHE_SIZE', 100))
+max_queries: int = int(os.getenv('DATABASE_CONNECTION_MAX_QUERIES', 50000))
+lifetime: float = float(os.getenv('DATABASE_CONNECTION_LIFETIME', 300))
+init_callbacks: list[Callable[[asyncpg.Connection], Any]] = []
 
 async def init_pool():
+    """Creates the pool, init callbacks can be added to init_callbacks or passed as
+    DATABASE_POOL_INIT='package.module:function,...', they are called with new connections"""
     global _pool
-    _pool = await asyncpg.create_pool(url)
+    _pool = await asyncpg.create_pool(
+            url, connection_class=Connection, init=_init_connection,
+            min_size=min_size, max_size=max_size, statement_cache_size=statement_cache_size,
+            max_queries=max_queries, max_inactive_connection_lifetime=lifetime
+    )
+
+async def _init_connection(conn: asyncpg.Connection):
+    await conn.set_type_codec('jsonb', encoder=json.dumps, decoder=json.loads, schema='pg_catalog')
+    for callback in init_callbacks+_env_callbacks():
+        if asyncio.iscoroutine(value := callback(conn)):
+            await value
+
+def _env_callbacks() -> list[Callable[[asyncpg.Connection], Any]]:
+    callbacks = []
+    for path in filter(None, os.getenv('DATABASE_POOL_INIT', '').split(',')):
+        module, _, name = path.strip().partition(':')
+        callbacks.append(getattr(importlib.import_module(module), name))
+    return callbacks
+
+async def close_pool(timeout: float = 30):
+    """Waits until acquired connections are released and closes the pool,
+    new acquires fail meanwhile, the pool is terminated after timeout"""
+    try:
+        await asyncio.wait_for(_pool.close(), timeout)
+    except asyncio.TimeoutError:
+        _pool.terminate()
+
+@dataclass
+class PoolStats:
+    size: int
+    idle: int
+    min_size: int
+    max_size: int
+    waiters: int
+    acquire: CallStats
+
+_waiters = 0
+_acquire_stats = CallStats()
+def pool_stats() -> PoolStats:
+    """Returns the current state of the pool, acquire is distribution of 
+    waiting for connections by helpers"""
+    return PoolStats(_pool.get_size(), _pool.get_idle_size(), _pool.get_min_size(),
+                     _pool.get_max_size(), _waiters, _acquire_stats)
+
+
+class Statements(OrderedDict[str, PreparedStatement]):
+    """LRU of named prepared statements of one connection"""
+    def __init__(self):
+        super().__init__()
+        self.version = _schema_version
+
+class Connection(asyncpg.Connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.statements = Statements()
+
+@dataclass
+class StatementStats:
+    calls: int = 0
+    time: float = 0.0
+
+_schema_version = 0
+_stats: defaultdict[str, StatementStats] = defaultdict(StatementStats)
+def statement_stats() -> dict[str, StatementStats]:
+    return dict(_stats)
+
+def invalidate_statements():
+    """Forget prepared statements of all connections, 
+    must be called after the schema was changed"""
+    global _schema_version
+    _schema_version += 1
+
+async def _prepare(conn: Connection, query: str) -> PreparedStatement:
+    statements: Statements = conn.statements
+    if statements.version != _schema_version:
+        statements.clear()
+        statements.version = _schema_version
+    if statement := statements.get(query):
+        statements.move_to_end(query)
+        return statement
+
+    statement = statements[query] = await conn.prepare(query, name=f'wpg_{next(_names)}')
+    if len(statements) > prepared:
+        statements.popitem(last=False)
+    return statement
+_names = itertools.count(1)
+
+async def _run_prepared(conn: Connection, method: str, query: str, *args):
+    start = time.perf_counter()
+    try:
+        value = await getattr(await _prepare(conn, query), method)(*args)
+    except (asyncpg.InvalidCachedStatementError, asyncpg.OutdatedSchemaCacheError):
+        conn.statements.pop(query, None)
+        value = await getattr(await _prepare(conn, query), method)(*args)
+    stats = _stats[query]
+    stats.calls += 1
+    stats.time += time.perf_counter()-start
+    return value
+
+
+@dataclass
+class Trace:
+    """Call of a helper, which is passed to hooks after the connection was released,
+    wait is time of acquiring of the connection. Calls, whose args aren't the parameters 
+    of one run of the query, e.g. chunks or executemany, aren't explainable"""
+    query: str
+    args: tuple
+    wait: float = 0.0
+    time: float = 0.0
+    rows: int = 0
+    error: bool = False
+    explainable: bool = True
 
+hooks: list[Callable[[Trace], None]] = []
 
-async def execute(query: str, *args):
-    async with _pool.acquire() as conn:
-        await conn.execute(query, *args)
+@asynccontextmanager
+async def _connection() -> AsyncIterator[tuple[Connection, float]]:
+    """Acquires the connection of the pool, counts waiters and time of waiting for it"""
+    global _waiters
+    start = time.perf_counter()
+    _waiters += 1
+    try:
+        conn = await _pool.acquire()
+    finally:
+        _waiters -= 1
+    wait = time.perf_counter()-start
+    _acquire_stats.add(int(wait*1e9))
+    try:
+        yield conn, wait
+    finally:
+        await _pool.release(conn)
+
+@asynccontextmanager
+async def _acquire(
+        query: str, args: tuple, explainable: bool = True
+        ) -> AsyncIterator[tuple[Connection, Trace]]:
+    trace = Trace(query, args, explainable=explainable)
+    acquired = time.perf_counter()
+    try:
+        if current := _session.get():
+            try:
+                await current.flush()
+                acquired = time.perf_counter()
+                trace.wait, current.wait = current.wait, 0.0
+                yield current.conn, trace
+            except Exception as e:
+                current.error = current.error or e
+                raise
+            return
+        async with _connection() as (conn, wait):
+            acquired, trace.wait = time.perf_counter(), wait
+            yield conn, trace
+    except Exception:
+        trace.error = True
+        raise
+    finally:
+        trace.time = time.perf_counter()-acquired
+        _emit(trace)
+
+def _emit(trace: Trace):
+    for hook in hooks:
+        hook(trace)
+
+def _status_rows(status: str) -> int:
+    count = status.rsplit(' ', 1)[-1]
+    return int(count) if count.isdigit() else 0
+
+
+class Session:
+    """Unit of work, which pins one connection and runs one transaction.
+    Writes of execute are queued and sent before the next read and at the end,
+    consecutive writes with the same query and parameters are sent by one executemany
+    and consecutive writes without parameters by one script, other writes are sent one by one.
+    Wait is time of acquiring of the connection, it's passed with the first trace.
+    Error is the first error of statements of the session, the transaction is aborted by it,
+    so it is raised at the end, even if it was caught or swallowed by the caller"""
+    def __init__(self, conn: Connection):
+        self.conn = conn
+        self.writes: list[tuple[str, tuple]] = []
+        self.error: Exception | None = None
+        self.wait = 0.0
+
+    def queue(self, query: str, *args):
+        self.writes.append((query, args))
+
+    async def flush(self):
+        writes, self.writes = self.writes, []
+        script = []
+        for query, group in itertools.groupby(writes, key=lambda write: write[0]):
+            args = [args for _, args in group]
+            if not args[0]:
+                script += [query]*len(args)
+                continue
+            if script:
+                await self._send(';\n'.join(script), ())
+                script = []
+            await self._send(query, args)
+        if script:
+            await self._send(';\n'.join(script), ())
+
+    async def _send(self, query: str, args: list[tuple] | tuple):
+        trace = Trace(query, tuple(args[0]) if len(args) == 1 else tuple(args), 
+                      explainable=len(args) == 1)
+        trace.wait, self.wait = self.wait, 0.0
+        start = time.perf_counter()
+        try:
+            if len(args) == 1:
+                trace.rows = _status_rows(await self.conn.execute(query, *args[0]))
+            elif args:
+                await self.conn.executemany(query, args)
+            else:
+                await self.conn.execute(query)
+        except Exception:
+            trace.error = True
+            raise
+        finally:
+            trace.time = time.perf_counter()-start
+            _emit(trace)
+
+_session: ContextVar[Session | None] = ContextVar('session', default=None)
+def current_session() -> Session | None:
+    return _session.get()
+
+@asynccontextmanager
+async def session() -> AsyncIterator[Session]:
+    """Helpers and methods of tables, which are called inside, join the session,
+    the transaction is rolled back if an exception was raised or a statement failed,
+    the error of the statement is raised at the end then. 
+    Nested sessions join the outer one, the session mustn't be used by 
+    several tasks at the same time
+
+        async with session():
+            country = await Country.select('balance', name='Russia')
+            await Country.update({'balance': ...}, name='Russia')
+            await Ware.insert(name='sword', country=...)"""
+    if current := _session.get():
+        yield current
+        return
+    async with _connection() as (conn, wait):
+        async with conn.transaction():
+            session_ = Session(conn)
+            session_.wait = wait
+            token = _session.set(session_)
+            try:
+                yield session_
+                await session_.flush()
+                if session_.error:
+                    raise session_.error
+            finally:
+                _session.reset(token)
+
+
+async def execute(query: str, *args) -> int | None:
+    """Returns count of changed rows, or None if the query was queued by session"""
+    if current := _session.get():
+        return current.queue(query, *args)
+    async with _acquire(query, args) as (conn, trace):
+        if prepared and args:
+            await _run_prepared(conn, 'fetch', query, *args)
+            trace.rows = _status_rows(conn.statements[query].get_statusmsg())
+        else:
+            trace.rows = _status_rows(await conn.execute(query, *args))
+    return trace.rows
 
 async def executemany(query: str, *args):
-    async with _pool.acquire() as conn:
-        await conn.executemany(query, *args)
+    async with _acquire(query, args, explainable=False) as (conn, trace):
+        if prepared:
+            await _run_prepared(conn, 'executemany', query, *args)
+        else:
+            await conn.executemany(query, *args)
 
 async def fetch(query: str, *args) -> Sequence[Mapping]:
-    async with _pool.acquire() as conn:
-        return await conn.fetch(query, *args)
+    async with _acquire(query, args) as (conn, trace):
+        if prepared:
+            output = await _run_prepared(conn, 'fetch', query, *args)
+        else:
+            output = await conn.fetch(query, *args)
+        trace.rows = len(output)
+        return output
 
 async def fetchone(query: str, *args) -> Mapping:
-    async with _pool.acquire() as conn:
-        return await conn.fetchrow(query, *args)
+    async with _acquire(query, args) as (conn, trace):
+        if prepared:
+            row = await _run_prepared(conn, 'fetchrow', query, *args)
+        else:
+            row = await conn.fetchrow(query, *args)
+        trace.rows = int(row is not None)
+        return row
+
+async def cursor(query: str, *args, prefetch: int = 100) -> AsyncIterator[Mapping]:
+    """Iterate over rows of query with server-side cursor, 
+    which fetches prefetch rows at a time"""
+    async with _acquire(query, args) as (conn, trace):
+        async with conn.transaction():
+            async for row in conn.cursor(query, *args, prefetch=prefetch):
+                trace.rows += 1
+                yield row
+
+async def fetch_chunks(query: str, chunks: AsyncIterable[Sequence]) -> list[Row]:
+    """Fetches query with every arguments of chunks in one transaction,
+    returns rows of all chunks"""
+    output = []
+    async with _acquire(query, (), explainable=False) as (conn, trace):
+        async with conn.transaction():
+            async for args in chunks:
+                output += await conn.fetch(query, *args)
+        trace.rows = len(output)
+    return output
+
+async def execute_chunks(query: str, chunks: AsyncIterable[Sequence]) -> int:
+    """Executes query with every arguments of chunks in one transaction,
+    returns count of changed rows"""
+    async with _acquire(query, (), explainable=False) as (conn, trace):
+        async with conn.transaction():
+            async for args in chunks:
+                trace.rows += _status_rows(await conn.execute(query, *args))
+    return trace.rows
+
+async def copy_records(table: str, columns: Sequence[str], 
+                       chunks: AsyncIterable[Sequence[tuple]]) -> int:
+    """Copy chunks of records into table in one transaction, 
+    returns count of copied records"""
+    async with _acquire(f'COPY {table}({", ".join(columns)}) FROM STDIN', (), 
+                        explainable=False) as (conn, trace):
+        async with conn.transaction():
+            async for records in chunks:
+                status = await conn.copy_records_to_table(table, records=records, columns=columns)
+                trace.rows += _status_rows(status)
+    return trace.rows
 
 
 if __name__ == '__main__':
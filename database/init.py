@@ -1,149 +1,527 @@
 import asyncio
-from typing import Coroutine
+import hashlib
+import os
+import re
+from dataclasses import dataclass, field as dataclass_field, replace
 
-from logger import logger
-from meta import Table
-from fields import Field, Generated, Sequence, TablesAttitude as TA
-from constraints import constraint
-from functions import init_pool, pool
+import asyncpg
 
+from logger import debug_logger, logger
+from meta import Table, association, unresolved
+from fields import Field, Generated, Sequence, TablesAttitude as TA, identifier
+from constraints import Index, Partition, Trade
+from functions import init_pool, invalidate_statements, pool
+import cache
+import tracing
+
+
+snapshot: str | None = os.getenv('DATABASE_SCHEMA_SNAPSHOT')
 
 @logger
-async def init(create_tables=False):
+async def init(create_tables=False, dry_run=False, force=False, parallel=False, drop_columns=False):
     await init_pool()
+    if tracing.trace:
+        tracing.enable()
     if create_tables:
-        await _create_tables()
+        await _create_tables(dry_run, force, parallel, drop_columns)
+        if not dry_run:
+            await attach_partitions()
+    tables = Table.subtables()
+    if any(getattr(table, '__cache__', None) for table in tables):
+        await cache.listen(tables)
+
+@dataclass
+class Schema:
+    """Columns, constraints, indexes and functions of a table,
+    which are declared by Table or are created in the database.
+    Partitions are declared ones, which are created with the table"""
+    name: str
+    fields: dict[str, Field] = dataclass_field(default_factory=dict)
+    constraints: dict[str, str] = dataclass_field(default_factory=dict)
+    indexes: dict[str, str] = dataclass_field(default_factory=dict)
+    functions: dict[str, str] = dataclass_field(default_factory=dict)
+    populated: bool = False
+    partition: str | None = None
+    partitions: dict[str, str] = dataclass_field(default_factory=dict)
+    references: dict[str, str] = dataclass_field(default_factory=dict)
+    deferred: set[str] = dataclass_field(default_factory=set)
+
+Level = dict[str, list[str]]
 
 @logger
-async def _create_tables():
+async def _create_tables(dry_run=False, force=False, parallel=False, drop_columns=False) -> str:
+    """Creates or alters tables of Table.subtables() with one script and returns it,
+    the script is logged and returned instead if dry_run.
+    Columns, which aren't declared, are dropped only if drop_columns.
+    If parallel, tables of one level are created at the same time
+    on different connections, but the migration isn't atomic then.
+    New indexes of populated tables are created concurrently after the script.
+    Nothing is done if fingerprint of tables wasn't changed since the last time.
+    Workers, which start at the same time, are serialized by the advisory lock,
+    so the next one finds the fingerprint of the first one"""
+    tables = Table.subtables()
+    schemas = _schemas(tables)
+    order = _levels(schemas)
+    fingerprint = _fingerprint(tables, schemas)
+    check = not dry_run and not force
+    if check and _read_snapshot() == fingerprint:
+        return ''
     async with pool().acquire() as conn:
-        async with conn.transaction():
-            processed_tables = []
-            for table in Table.subtables():
-                created_fields = await conn.fetch(
-                    'SELECT column_name AS name, data_type AS sql_type, '
-                    'column_default AS default, is_nullable AS is_null, '
-                    'is_identity, identity_generation AS generation, '
-                    'identity_start AS start, identity_increment AS increment, '
-                    'identity_maximum AS max, identity_minimum AS min, '
-                    'is_generated, generation_expression AS expression '
-                    'FROM information_schema.columns '
-                    'WHERE table_name = $1', table.table
-                )
-                if created_fields:
-                    created_constraints = await conn.fetch(
-                            'SELECT constraint_name AS name FROM information_schema.constraint_table_usage '
-                            'WHERE table_name = $1', table.table
-                    )
-                    func = _alter_table(conn, created_fields, created_constraints, 
-                                        table, processed_tables)
-                else:
-                    func = _create_table(conn, table, processed_tables)
-                query, precreates, postcreates = await func
-                [await p for p in precreates]
-                await conn.execute(query) if query else ...
-                await asyncio.gather(*postcreates)
-                processed_tables.append(table)
-
-Precreates = Postcreates = list[Coroutine]
+        if check and await _created_fingerprint(conn) == fingerprint:
+            _write_snapshot(fingerprint)
+            return ''
+        await conn.execute('SELECT pg_advisory_lock($1)', _LOCK)
+        try:
+            if check and await _created_fingerprint(conn) == fingerprint:
+                _write_snapshot(fingerprint)
+                return ''
+            created = _created_schemas(await conn.fetch(_CATALOG_QUERY, list(schemas)))
+            levels, deferred, concurrent = _migration(schemas, created, order, drop_columns)
+            script = _script(levels, deferred)
+            if dry_run:
+                script = _script(levels, deferred, concurrent)
+                debug_logger.info('Migration, which would be applied\n%s', script)
+                return script
+            if parallel:
+                await _apply(levels, deferred)
+            async with conn.transaction():
+                await conn.execute(script+';\n'+_FINGERPRINT_TABLE if script and not parallel
+                                   else _FINGERPRINT_TABLE)
+            for statement in concurrent:
+                await conn.execute(statement)
+            await conn.execute(_FINGERPRINT_QUERY, fingerprint)
+            script = _script(levels, deferred, concurrent)
+        finally:
+            await conn.execute('SELECT pg_advisory_unlock($1)', _LOCK)
+    _write_snapshot(fingerprint)
+    invalidate_statements()
+    return script
+
+# Lock of the session, because parallel levels and concurrent indexes 
+# are created outside of the transaction of the connection
+_LOCK = int.from_bytes(hashlib.sha256(b'schema_fingerprint').digest()[:8], 'big', signed=True)
+_FINGERPRINT_TABLE = '''CREATE TABLE IF NOT EXISTS schema_fingerprint(
+id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK(id),
+fingerprint TEXT NOT NULL,
+updated TIMESTAMPTZ NOT NULL DEFAULT now())'''
+_FINGERPRINT_QUERY = 'INSERT INTO schema_fingerprint(fingerprint) VALUES($1) '\
+                     'ON CONFLICT(id) DO UPDATE SET fingerprint = $1, updated = now()'
+
 @logger
-async def _alter_table(
-        conn, created_fields, created_constraints, table, processed_tables
-        ) -> tuple[str, Precreates, Postcreates]:
-    fields, constraints, precreates, postcreates = _table_fields(conn, table, processed_tables)
-    droping_fields, altering_fields = map(set, ((),)*3)
-    for created_field in created_fields:
-        for field in fields:
-            if field.name == created_field['name']: break
-        else:
-            droping_fields.add(created_field['name'])
+def _fingerprint(tables: list[Table], schemas: dict[str, Schema]) -> str:
+    """Returns hash of definitions of tables, which doesn't depend on order of tables"""
+    definition = []
+    for table in tables:
+        definition += (f'{table.table}.{key} {field.name} {field.sql_type} {field.generated!r} '
+                       f'{field.not_null} {field.attitude.name}'
+                       for key, field in table.fields.items())
+    for schema in schemas.values():
+        definition += (f'{schema.name} {field}' for field in schema.fields.values())
+        definition += (f'{schema.name} {name} {c}' for name, c in schema.constraints.items())
+        definition += (f'{schema.name} {name} {i}' for name, i in schema.indexes.items())
+        definition += schema.functions.values()
+        if schema.partition:
+            definition.append(f'{schema.name} PARTITION BY {schema.partition}')
+    return hashlib.sha256('\n'.join(sorted(definition)).encode()).hexdigest()
+
+async def _created_fingerprint(conn) -> str | None:
+    try:
+        return await conn.fetchval('SELECT fingerprint FROM schema_fingerprint')
+    except asyncpg.UndefinedTableError:
+        return None
+
+def _read_snapshot() -> str | None:
+    if snapshot and os.path.exists(snapshot):
+        with open(snapshot) as file:
+            return file.read().strip()
+
+def _write_snapshot(fingerprint: str):
+    if snapshot:
+        with open(snapshot, 'w') as file:
+            file.write(fingerprint)
+
+
+@logger
+def _levels(schemas: dict[str, Schema]) -> list[list[str]]:
+    """Sorts tables by foreign keys, tables of one level don't depend on each other.
+    A cycle is broken by the foreign key, which closes it,
+    the key becomes deferrable and is added after all tables"""
+    depends = {name: {t for t in schema.references.values() if t != name and t in schemas}
+               for name, schema in schemas.items()}
+    levels = []
+    while depends:
+        level = sorted(name for name, tables in depends.items() if not tables)
+        if not level:
+            table, referenced = _cycle(depends)
+            schema = schemas[table]
+            for name, table_ in schema.references.items():
+                if table_ == referenced:
+                    schema.constraints[name] += ' DEFERRABLE INITIALLY DEFERRED'
+                    schema.deferred.add(name)
+            depends[table].discard(referenced)
             continue
-        created_field = dict(created_field)
-        generated = None
-        if created_field.pop('is_identity'):
-            generated = Generated(
-                    type='IDENTITY', generation=created_field['generation'],
-                    options=Sequence(
-                        start=created_field['start'], increment=created_field['increment'], 
-                        max=created_field['max'], min=created_field['min']
-                    )
-            )
-        if created_field.pop('is_generated'):
-            generated = Generated(
-                    type='STORED', generation=created_field['generation'],
-                    options=created_field['expression']
-            )
-        [created_field.__delitem__(arg) for arg in 'generation start increment max min expression'.split()]
-        created_field = Field(**created_field, generated=generated)
-        for difference, value in field-created_field:
-            match difference:
-                case 'sql_type': altering_fields.add(f'SET DATA TYPE {value}')
-                case 'not_null': altering_fields.add(('SET' if value else 'DROP')+' NOT NULL')
-                case 'default':  altering_fields.add(f'SET DEFAULT {value}' if value else 'DROP DEFAULT')
-                case 'generated':
-                    if not value: altering_fields.add(f'DROP IDENTITY IF EXISTS')
-                    else: ...
-
-    adding_fields = fields
-    return '', [], []
+        levels.append(level)
+        for name in level:
+            del depends[name]
+        for tables in depends.values():
+            tables.difference_update(level)
+    return levels
+
+def _cycle(depends: dict[str, set[str]]) -> tuple[str, str]:
+    """Returns the last reference of a cycle, all tables in depends must have references"""
+    path = [min(depends)]
+    while (table := min(depends[path[-1]])) not in path:
+        path.append(table)
+    return path[-1], table
 
 @logger
-async def _create_table(
-        conn, table: Table, processed_tables: list[Table]
-        ) -> tuple[str, Precreates, Postcreates]:
-    fields, constraints, precreates, postcreates = _table_fields(conn, table, processed_tables)
-    fields = {str(field) for field in fields}
-    constraints = {f'CONSTRAINT {table.table}_{n} {c}' for n, c in constraints}
+def _migration(
+        schemas: dict[str, Schema], created: dict[str, Schema], levels: list[list[str]],
+        drop_columns: bool = False
+        ) -> tuple[list[Level], list[str], list[str]]:
+    """Returns statements of every table by levels, which turn created tables 
+    into declared ones, statements, which are run after all tables: 
+    deferred foreign keys and functions of tables, 
+    and statements, which are run concurrently outside of transaction"""
+    migration, deferred, concurrent = [], [], []
+    for names in levels:
+        level = {}
+        for name in names:
+            if name in created and _partition_changed(created[name].partition, 
+                                                      schemas[name].partition):
+                raise ValueError(f"I can't change partitioning of created table {name}")
+            if name in created:
+                level[name], deferred_ = _alter_table(schemas[name], created[name], drop_columns)
+            else:
+                level[name], deferred_ = _create_table(schemas[name])
+            level[name] += _indexes(schemas[name], created.get(name), concurrent)
+            deferred += deferred_
+        migration.append(level)
+    for schema in schemas.values():
+        deferred += schema.functions.values()
+    return migration, deferred, concurrent
 
-    query = ',\n'.join(fields | constraints)
-    return f'CREATE TABLE {table.table}(\n'+query+')', precreates, postcreates
+def _indexes(schema: Schema, created: Schema | None, concurrent: list[str]) -> list[str]:
+    """Indexes are compared only by names, because the database rewrites their definitions.
+    New indexes of populated tables are added to concurrent, 
+    an invalid index, which is left by failed concurrent creation, is dropped before"""
+    created_indexes = created.indexes if created else {}
+    statements = [f'DROP INDEX IF EXISTS {name}'
+                  for name in sorted(created_indexes.keys() - schema.indexes.keys())]
+    for name, definition in schema.indexes.items():
+        if name in created_indexes:
+            continue
+        elif created and created.populated:
+            concurrent += [f'DROP INDEX CONCURRENTLY IF EXISTS {name}',
+                           f'CREATE INDEX CONCURRENTLY {name} ON {schema.name} {definition}']
+        else:
+            statements.append(f'CREATE INDEX {name} ON {schema.name} {definition}')
+    return statements
+
+def _script(levels: list[Level], deferred: list[str], concurrent: list[str] = ()) -> str:
+    """Returns the migration as one ordered script"""
+    parts = []
+    for number, level in enumerate(levels, 1):
+        if statements := [s for statements in level.values() for s in statements]:
+            parts.append(f'-- level {number}\n'+';\n'.join(statements))
+    if deferred:
+        parts.append('-- after all tables\n'+';\n'.join(deferred))
+    if concurrent:
+        parts.append('-- concurrently, outside of transaction\n'+';\n'.join(concurrent))
+    return ';\n'.join(parts)
 
 @logger
-def _table_fields(
-        conn, table: Table, processed_tables: list[Table]
-        ) -> tuple[set[Field], set[constraint], Precreates, Postcreates]:
-    constraints, fields = set(), set()
-    precreates: Precreates = []
-    postcreates: Postcreates = []
-    for field in table.fields.values():
-        field, field_constr, field_precr, field_postcr = _field_handle(conn, table, field, processed_tables)
-        fields.add(field)
-        constraints = constraints.union(field_constr)
-        precreates += field_precr
-        postcreates += field_postcr
-    constraints = constraints.union(c.constraint for c in table.__constraints__)
-
-    return fields, constraints, precreates, postcreates
+async def _apply(levels: list[Level], deferred: list[str]):
+    """Applies tables of every level at the same time, each on own connection"""
+    async def apply(statements: list[str]):
+        async with pool().acquire() as conn:
+            async with conn.transaction():
+                await conn.execute(';\n'.join(statements))
+
+    for level in levels:
+        await asyncio.gather(*(apply(s) for s in level.values() if s))
+    if deferred:
+        await apply(deferred)
 
 @logger
-def _field_handle(
-        conn, table: Table, field: Field, processed_tables: list[Table]
-        ) -> tuple[Field, list[constraint], Precreates, Postcreates]:
-    name = field.name
-    constraints, precreates, postcreates = [], [], []
-    if field.attitude is not TA.Simple:
-        ref_is_created = field.type in processed_tables
-        if field.attitude in (TA.OneToOne, TA.ManyToOne) and ref_is_created:
-            constraints.append(
-                    (field.name+'_fkey', f'FOREIGN KEY({field.name}) REFERENCES {field.type.table}({field.name}) ON DELETE CASCADE')
-            )
-            precreates.append(conn.execute(
-                f'ALTER TABLE {field.type.table} '
-                f'ADD COLUMN IF NOT EXISTS {field.type.table}_id '
-                 'INT GENERATED ALWAYS AS IDENTITY PRIMARY KEY'
-            ))
+def _alter_table(
+        schema: Schema, created: Schema, drop_columns: bool = False
+        ) -> tuple[list[str], list[str]]:
+    """Columns, which aren't declared, are dropped only if drop_columns,
+    because renamed field looks like a new column and a dropped one"""
+    drops, alters, adds, deferred = [], [], [], []
+    for name, definition in created.constraints.items():
+        if _constraint_changed(definition, schema.constraints.get(name)):
+            drops.append(f'DROP CONSTRAINT {name}')
+    for name in created.fields.keys() - schema.fields.keys():
+        if drop_columns:
+            drops.append(f'DROP COLUMN {name}')
         else:
-            field = Field(table.table+'_id', 'INT', generated=Generated())
-            constraints.append((name+'_pkey', f'PRIMARY KEY({name})'))
-
-        if field.attitude is TA.ManyToMany:
-            table_name = f'{field.type.table}_{table.table}'
-            ref_id = f'{field.type.table}_id'
-            self_id = f'{table.table}_id'
-            postcreates.append(conn.execute(
-                f'CREATE TABLE IF NOT EXISTS {table_name}( '
-                f'{ref_id} INT REFERENCES {field.type.table}({ref_id}) ON DELETE CASCADE, '
-                f'{self_id} INT REFERENCES {table.table}({self_id}) ON DELETE CASCADE, '
-                f'CONSTRAINT {table_name}_{ref_id}_{self_id}_un UNIQUE({ref_id}, {self_id}))'
-            ))
-    return field, constraints, precreates, postcreates
+            debug_logger.warning("Column %s.%s isn't declared, it's kept, "
+                                 "pass drop_columns to drop it", schema.name, name)
+
+    for name, field in schema.fields.items():
+        if not (created_field := created.fields.get(name)):
+            adds.append(f'ADD COLUMN {field}')
+            continue
+        for difference, value in (_normalized(field)-created_field).items():
+            alters += _alter_column(field, created_field, difference, value)
+
+    for name, definition in schema.constraints.items():
+        if _constraint_changed(created.constraints.get(name), definition):
+            constraint = f'ADD CONSTRAINT {name} {definition}'
+            (deferred if name in schema.deferred else adds).append(constraint)
+
+    alter = f'ALTER TABLE {schema.name} '
+    return [alter+', '.join(s) for s in (drops, adds, alters) if s], \
+           [alter+c for c in deferred]
+
+def _normalized(field: Field) -> Field:
+    """Returns field in the form of created one, identity columns are always not null"""
+    identity = field.generated and field.generated.type == 'IDENTITY'
+    return replace(field, sql_type=field.sql_type and _sql_type(field.sql_type),
+                   not_null=field.not_null or bool(identity))
+
+def _alter_column(field: Field, created: Field, difference: str, value) -> list[str]:
+    """Expressions of stored generated columns can't be altered, 
+    so only identities are compared"""
+    alter = f'ALTER COLUMN {field.name} '
+    match difference:
+        case 'sql_type' if value:
+            return [alter+f'TYPE {value} USING {field.name}::{value}']
+        case 'not_null':
+            return [alter+('SET' if value else 'DROP')+' NOT NULL']
+        case 'generated' if not value and created.generated.type == 'STORED':
+            return [alter+'DROP EXPRESSION IF EXISTS']
+        case 'generated' if not value:
+            return [alter+'DROP IDENTITY IF EXISTS']
+        case 'generated' if value.type == 'IDENTITY' and not created.generated:
+            return [alter+f'ADD {value}']
+        case 'generated' if value.type == 'IDENTITY':
+            options = value.options
+            return [alter+f'SET GENERATED {value.generation} SET INCREMENT BY {options.increment} '
+                          f'SET START WITH {options.start} '+
+                          (f'SET MAXVALUE {options.max} ' if options.max is not None else 'SET NO MAXVALUE ')+
+                          (f'SET MINVALUE {options.min}' if options.min is not None else 'SET NO MINVALUE')]
+    return []
+
+@logger
+def _create_table(schema: Schema) -> tuple[list[str], list[str]]:
+    fields = [str(field) for field in schema.fields.values()]
+    constraints, deferred = [], []
+    for name, definition in schema.constraints.items():
+        if name in schema.deferred:
+            deferred.append(f'ALTER TABLE {schema.name} ADD CONSTRAINT {name} {definition}')
+        else:
+            constraints.append(f'CONSTRAINT {name} {definition}')
+
+    query = ',\n'.join(fields+constraints)
+    partition = f' PARTITION BY {schema.partition}' if schema.partition else ''
+    return [f'CREATE TABLE {schema.name}(\n'+query+')'+partition]+\
+           [f'CREATE TABLE {name} PARTITION OF {schema.name} {bound}'
+            for name, bound in schema.partitions.items()], deferred
+
+def _partition_changed(created: str | None, partition: str | None) -> bool:
+    normalize = lambda partition: re.sub(r'\s+', '', partition or '').lower()
+    return normalize(created) != normalize(partition)
+
+def _constraint_changed(created: str | None, definition: str | None) -> bool:
+    """CHECK constraints are compared only by names,
+    because the database rewrites their expressions"""
+    if not created or not definition:
+        return created != definition
+    elif definition.upper().startswith('CHECK'):
+        return False
+    normalize = lambda definition: re.sub(r'\s+', '', definition).lower()
+    return normalize(created) != normalize(definition)
+
+
+@logger
+def _schemas(tables: list[Table]) -> dict[str, Schema]:
+    """Returns schemas of tables and association tables of ManyToMany fields"""
+    if missing := unresolved():
+        raise ValueError(f"I can't create tables, tables {', '.join(missing)} aren't declared")
+    referenced = {field.type for table in tables for field in table.fields.values()
+                  if field.attitude in (TA.OneToOne, TA.ManyToOne)}
+    schemas = {}
+    for table in tables:
+        schema = schemas[table.table] = Schema(table.table)
+        to_many = any(f.attitude in (TA.OneToMany, TA.ManyToMany) for f in table.fields.values())
+        if table in referenced or to_many:
+            id_ = Field(f'{table.table}_id', 'INT', generated=Generated())
+            schema.fields[id_.name] = id_
+            schema.constraints[identifier(f'{table.table}_pkey')] = f'PRIMARY KEY({id_.name})'
+        for field in table.fields.values():
+            _field_handle(schemas, table, field)
+        for constraint in table.__constraints__:
+            constraints = constraint.constraint
+            for name, definition in constraints if type(constraints) is list else [constraints]:
+                schema.constraints[identifier(f'{table.table}_{name}')] = definition
+            if isinstance(constraint, Index):
+                name, definition = constraint.index
+                schema.indexes[identifier(f'{table.table}_{name}')] = definition
+            if isinstance(constraint, Trade):
+                schema.functions.update(constraint.functions(table))
+        for partition in (c for c in table.__constraints__ if isinstance(c, Partition)):
+            _partition_handle(schema, table, partition, table in referenced or to_many)
+    for schema in schemas.values():
+        for name in [n for n, i in schema.indexes.items() if _covered(schema, i)]:
+            del schema.indexes[name]
+    for table in tables:
+        if getattr(table, '__cache__', None):
+            for name in cache.tables(table):
+                schemas[name].functions[f'{name}_notify'] = cache.trigger(name)
+    return schemas
+
+def _partition_handle(schema: Schema, table: Table, partition, referenced: bool):
+    """Unique constraints of partitioned table must include the partition key,
+    so id of the table isn't unique and the table can't be referenced"""
+    if schema.partition:
+        raise ValueError(f"I can't partition table {table.table} twice")
+    elif referenced:
+        raise ValueError(f"I can't partition table {table.table}, which is referenced")
+    key = re.compile(rf'\b{partition.field}\b')
+    for name, definition in schema.constraints.items():
+        if re.match(r'(UNIQUE|PRIMARY KEY)', definition, re.I) and not key.search(definition):
+            raise ValueError(f"I can't partition table {table.table} by {partition.field}, "
+                             f"unique {name} doesn't include it")
+    schema.partition = partition.partition
+    schema.partitions = {name: bound for name, (bound, _) 
+                         in partition.partitions(table.table).items()}
+
+@logger
+async def attach_partitions():
+    """Attaches partitions of partitioned tables, which are missing, 
+    range partitions are attached for rows of the default partition and ahead of the max key. 
+    It should be called periodically, e.g. every turn"""
+    async with pool().acquire() as conn:
+        for table in Table.subtables():
+            for partition in (c for c in table.__constraints__ if isinstance(c, Partition)):
+                created = {row['relname'] for row in 
+                           await conn.fetch(_PARTITIONS_QUERY, table.table)}
+                first = last = None
+                if partition.method == 'range':
+                    first, last = await conn.fetchrow(
+                            f'SELECT (SELECT min({partition.field}) '
+                            f'FROM {partition.default(table.table)}), '
+                            f'(SELECT max({partition.field}) FROM {table.table})'
+                    )
+                for name, (bound, where) in partition.partitions(table.table, last, first).items():
+                    if name in created: continue
+                    async with conn.transaction():
+                        for statement in partition.attach(table.table, name, bound, where):
+                            await conn.execute(statement)
+
+_PARTITIONS_QUERY = '''
+SELECT c.relname FROM pg_inherits i 
+JOIN pg_class c ON c.oid = i.inhrelid
+WHERE i.inhparent = $1::regclass
+'''
+
+def _covered(schema: Schema, index: str) -> bool:
+    """Index of one column is needless if the column leads unique constraint"""
+    if not (column := re.fullmatch(r'USING btree\((\w+)\)', index)):
+        return False
+    leading = re.compile(rf'(UNIQUE|PRIMARY KEY)\s*\(\s*{column[1]}\b', re.I)
+    return any(leading.match(c) for c in schema.constraints.values())
+
+@logger
+def _field_handle(schemas: dict[str, Schema], table: Table, field: Field):
+    schema = schemas[table.table]
+    if field.attitude is TA.Simple:
+        schema.fields[field.name] = field
+    elif field.attitude in (TA.OneToOne, TA.ManyToOne):
+        schema.fields[field.name] = Field(field.name, 'INT')
+        name = identifier(f'{table.table}_{field.name}_fkey')
+        schema.constraints[name] = _foreign_key(field.name, field.type.table)
+        schema.references[name] = field.type.table
+        schema.indexes[identifier(f'{table.table}_{field.name}_idx')] = f'USING btree({field.name})'
+    elif field.attitude is TA.ManyToMany:
+        name = association(table, field.type)
+        schema = schemas.setdefault(name, Schema(name))
+        for table_ in (table, field.type):
+            id_ = f'{table_.table}_id'
+            schema.fields[id_] = Field(id_, 'INT')
+            key = identifier(f'{name}_{id_}_fkey')
+            schema.constraints[key] = _foreign_key(id_, table_.table)
+            schema.references[key] = table_.table
+            schema.indexes[identifier(f'{name}_{id_}_idx')] = f'USING btree({id_})'
+        ids = sorted(schema.fields)
+        schema.constraints[identifier(f'{name}_{"_".join(ids)}_un')] = f'UNIQUE({", ".join(ids)})'
+
+def _foreign_key(column: str, table: str) -> str:
+    return f'FOREIGN KEY({column}) REFERENCES {table}({table}_id) ON DELETE CASCADE'
+
+
+_CATALOG_QUERY = '''
+SELECT c.relname AS name,
+    (SELECT jsonb_agg(jsonb_build_object(
+        'name', a.attname, 'sql_type', format_type(a.atttypid, a.atttypmod),
+        'not_null', a.attnotnull, 'identity', a.attidentity, 'generated', a.attgenerated,
+        'expression', pg_get_expr(d.adbin, d.adrelid), 'start', s.seqstart,
+        'increment', s.seqincrement, 'max', s.seqmax, 'min', s.seqmin
+     ) ORDER BY a.attnum)
+     FROM pg_attribute a
+     LEFT JOIN pg_attrdef d ON d.adrelid = a.attrelid AND d.adnum = a.attnum
+     LEFT JOIN pg_depend dep ON dep.refobjid = a.attrelid AND dep.refobjsubid = a.attnum
+          AND dep.classid = 'pg_class'::regclass AND dep.deptype = 'i'
+     LEFT JOIN pg_sequence s ON s.seqrelid = dep.objid
+     WHERE a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped) AS fields,
+    (SELECT jsonb_object_agg(con.conname, pg_get_constraintdef(con.oid))
+     FROM pg_constraint con
+     WHERE con.conrelid = c.oid AND con.contype IN ('p', 'f', 'u', 'c', 'x')) AS constraints,
+    (SELECT jsonb_object_agg(i.relname, pg_get_indexdef(i.oid))
+     FROM pg_index x
+     JOIN pg_class i ON i.oid = x.indexrelid
+     WHERE x.indrelid = c.oid AND x.indisvalid
+       AND NOT EXISTS(SELECT FROM pg_constraint con WHERE con.conindid = i.oid)) AS indexes,
+    pg_relation_size(c.oid) > 0 AS populated,
+    CASE WHEN c.relkind = 'p' THEN pg_get_partkeydef(c.oid) END AS partition
+FROM pg_class c
+JOIN pg_namespace n ON n.oid = c.relnamespace
+WHERE n.nspname = current_schema() AND c.relkind IN ('r', 'p') AND c.relname = ANY($1::TEXT[])
+'''
+
+def _created_schemas(rows) -> dict[str, Schema]:
+    schemas = {}
+    for row in rows:
+        fields = (_created_field(field) for field in row['fields'] or ())
+        schemas[row['name']] = Schema(row['name'], {f.name: f for f in fields},
+                                      row['constraints'] or {}, row['indexes'] or {},
+                                      populated=row['populated'], partition=row['partition'])
+    return schemas
+
+_default_max = {32767, 2147483647, 9223372036854775807, -1}
+_default_min = {1, -32768, -2147483648, -9223372036854775808}
+def _created_field(field: dict) -> Field:
+    generated = None
+    if field['identity']:
+        generated = Generated(
+                type='IDENTITY', generation='ALWAYS' if field['identity'] == 'a' else 'BY DEFAULT',
+                options=Sequence(
+                    start=field['start'], increment=field['increment'],
+                    max=None if field['max'] in _default_max else field['max'],
+                    min=None if field['min'] in _default_min else field['min']
+                )
+        )
+    elif field['generated']:
+        generated = Generated(type='STORED', options=field['expression'])
+    return Field(field['name'], _sql_type(field['sql_type']),
+                 not_null=field['not_null'], generated=generated)
+
+
+_aliases = {
+    'int': 'integer', 'int4': 'integer', 'int2': 'smallint', 'int8': 'bigint',
+    'float': 'double precision', 'float8': 'double precision', 'float4': 'real',
+    'bool': 'boolean', 'decimal': 'numeric', 'varchar': 'character varying', 'char': 'character',
+    'timestamp': 'timestamp without time zone', 'timestamptz': 'timestamp with time zone',
+    'time': 'time without time zone', 'timetz': 'time with time zone'
+}
+def _sql_type(sql_type: str) -> str:
+    """Returns type in the form, which the database uses"""
+    sql_type = ' '.join(sql_type.lower().split())
+    arrays = sql_type.count('[]')
+    type_, _, size = sql_type.replace('[]', '').partition('(')
+    type_ = _aliases.get(type_.strip(), type_.strip())
+    size = '('+size.replace(' ', '') if size else ''
+    return type_+size+'[]'*arrays
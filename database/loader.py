@@ -0,0 +1,78 @@
+import asyncio
+from collections import defaultdict
+from typing import Hashable
+
+from functions import Row, fetch
+from meta import Table, association
+from fields import Field, TablesAttitude as TA
+
+
+class Loader:
+    """Batches lookups of rows of the table by the field, which were made
+    in the same tick of event loop, into one query with = ANY($1)
+
+    Loader(Ware, 'country').load(country_id) returns wares of the country,
+    Loader(Item, 'item_id').load(item_id) returns the item in the list,
+    Loader(Pact, 'countries').load(country_id) returns pacts of the country"""
+    def __init__(self, table: Table, field: str, fields: str = None):
+        self.table, self.field = table, field
+        self.query = _query(table, field, fields)
+        self._futures: dict[Hashable, asyncio.Future] = {}
+        self._batch: list[Hashable] = []
+
+    def load(self, key: Hashable) -> asyncio.Future:
+        """Returns future of rows of the table linked with key,
+        lookups of keys, which are loading already, share the future"""
+        if future := self._futures.get(key):
+            return future
+        loop = asyncio.get_running_loop()
+        future = self._futures[key] = loop.create_future()
+        if not self._batch:
+            loop.call_soon(self._dispatch)
+        self._batch.append(key)
+        return future
+
+    async def load_many(self, keys: list[Hashable]) -> list[list[Row]]:
+        return await asyncio.gather(*map(self.load, keys))
+
+    def _dispatch(self):
+        batch, self._batch = self._batch, []
+        asyncio.ensure_future(self._load(batch))
+
+    async def _load(self, batch: list[Hashable]):
+        try:
+            output = await fetch(self.query, batch)
+        except Exception as e:
+            for key in batch:
+                if not (future := self._futures.pop(key)).done(): future.set_exception(e)
+            return
+
+        rows = defaultdict(list)
+        for row in output:
+            rows[row[self.field]].append(row)
+        for key in batch:
+            if not (future := self._futures.pop(key)).done(): future.set_result(rows.get(key, []))
+
+
+def _query(table: Table, name: str, fields: str | None) -> str:
+    """Rows are loaded by the field or by id of the table"""
+    if name == f'{table.table}_id':
+        field = Field(name, 'INT')
+    elif not (field := table.fields.get(name)):
+        raise ValueError(f"I can't load {table.table} by unknown field {name}")
+    columns = fields.split() if fields else \
+              [n for n, f in table.fields.items() if f.attitude is TA.Simple]
+    params = {n: f'{table.table}.{n}' for n in columns}
+    match field.attitude:
+        case TA.Simple | TA.OneToOne | TA.ManyToOne:
+            column, source = f'{table.table}.{field.name}', table.table
+        case TA.ManyToMany:
+            association_ = association(table, field.type)
+            column = f'{association_}.{field.type.table}_id'
+            source = f'{table.table} JOIN {association_} USING({table.table}_id)'
+        case TA.OneToMany:
+            raise ValueError(f"I can't load {table.table} by {name}, "
+                             f"load {field.type.table} by its linked field")
+    params[name] = f'{column} AS {name}'
+    return f'SELECT {", ".join(params.values())} FROM {source} '\
+           f'WHERE {column} = ANY($1::{field.sql_type}[])'
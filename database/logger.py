@@ -1,58 +1,130 @@
 import logging
 import logging.config
 import inspect
+import os
+import reprlib
+import threading
+import time
+
+from stats import CallStats
 
 
 logging.config.fileConfig('logger.conf', disable_existing_loggers=False)
+interval: float = float(os.getenv('DATABASE_CALL_STATS_INTERVAL', 0))
 
 def logger(func):
+    """Logs calls of the function, if debug is enabled, and counts them always"""
+    stats = _stats.setdefault(func.__qualname__, CallStats())
     def wrapper(*args, **kwargs):
-        _predebug(func, args, kwargs)
+        debug = debug_logger.isEnabledFor(logging.DEBUG)
+        if debug: _predebug(func, args, kwargs)
+        start = time.perf_counter_ns()
         try:
             value = func(*args, **kwargs)
         except Exception as e:
+            stats.add(time.perf_counter_ns()-start, error=True)
             _error_handler(e)
         else:
-            _postdebug(func, value)
+            stats.add(time.perf_counter_ns()-start)
+            if debug: _postdebug(func, value)
             return value
     async def awrapper(*args, **kwargs):
-        _predebug(func, args, kwargs)
+        debug = debug_logger.isEnabledFor(logging.DEBUG)
+        if debug: _predebug(func, args, kwargs)
+        start = time.perf_counter_ns()
         try:
             value = await func(*args, **kwargs)
         except Exception as e:
+            stats.add(time.perf_counter_ns()-start, error=True)
             _error_handler(e)
         else:
-            _postdebug(func, value)
+            stats.add(time.perf_counter_ns()-start)
+            if debug: _postdebug(func, value)
             return value
     return awrapper if inspect.iscoroutinefunction(func) else wrapper
 
 debug_logger = logging.getLogger('debugLogger')
 def _predebug(func, args, kwargs):
-    params = []
-    params = ', '.join(
-            [_str(arg) for arg in args]+\
-            [f'{k}={_str(v)}' for k, v in kwargs.items()]
-    ) if args or kwargs else ''
-    debug_logger.debug(f'Enter to {func.__name__}({params})')
+    debug_logger.debug('Enter to %s(%s)', func.__name__, _Params(args, kwargs))
+
+class _Params:
+    """Arguments, which are formatted only when the record is emitted"""
+    def __init__(self, args, kwargs):
+        self.args, self.kwargs = args, kwargs
+
+    def __str__(self) -> str:
+        return ', '.join([_str(arg) for arg in self.args]+
+                         [f'{k}={_str(v)}' for k, v in self.kwargs.items()])
 
+class _Value:
+    """Return value, which is formatted only when the record is emitted"""
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self) -> str:
+        return _str(self.value)
+
+_repr = reprlib.Repr()
+_repr.maxlist = _repr.maxtuple = _repr.maxdict = _repr.maxset = 10
+_repr.maxstring = _repr.maxother = 200
 def _str(arg) -> str:
-    try: return str(arg)
+    try: return _repr.repr(arg)
     except: return arg.__class__.__name__
 
 def _postdebug(func, value):
-    debug = f'Exit from {func.__name__}'
-    debug += f' with {value}' if value else ''
-    debug_logger.debug(debug)
+    if value:
+        debug_logger.debug('Exit from %s with %s', func.__name__, _Value(value))
+    else:
+        debug_logger.debug('Exit from %s', func.__name__)
 
 def _error_handler(error: Exception):
     error_logger = logging.getLogger('errorLogger')
     error_logger.error('Exception', exc_info=error)
 
 
+_stats: dict[str, CallStats] = {}
+def call_stats() -> dict[str, CallStats]:
+    return {name: stats for name, stats in _stats.items() if stats.calls}
+
+def reset_call_stats():
+    for stats in _stats.values():
+        stats.__init__()
+
+def report() -> str:
+    """Returns table of called functions sorted by their total time"""
+    lines = [f'{"function":<40} {"calls":>8} {"errors":>6} {"total s":>9} '
+             f'{"mean ms":>9} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9}']
+    for name, stats in sorted(call_stats().items(), key=lambda s: -s[1].time):
+        lines.append(f'{name:<40} {stats.calls:>8} {stats.errors:>6} {stats.time:>9.3f} '
+                     f'{stats.time/stats.calls*1e3:>9.3f} '+
+                     ' '.join(f'{stats.percentile(p)*1e3:>9.3f}' for p in (50, 95, 99)))
+    return '\n'.join(lines)
+
+def dump_call_stats():
+    debug_logger.info('Calls of functions\n%s', report())
+
+def dump_periodically(interval: float) -> threading.Event:
+    """Dumps stats every interval seconds in a daemon thread,
+    until the returned event is set"""
+    stop = threading.Event()
+    def dump():
+        while not stop.wait(interval):
+            dump_call_stats()
+    threading.Thread(target=dump, name='call-stats', daemon=True).start()
+    return stop
+
+
 import meta
 from meta import MetaTable
 from table import Table
 def _log_package(package):
+    """Classmethods are wrapped as classmethods,
+    otherwise they would be bound to the package instead of subclasses"""
     for name, func in inspect.getmembers(package, inspect.ismethod):
-        setattr(package, name, logger(func))
+        if inspect.isclass(func.__self__):
+            setattr(package, name, classmethod(logger(func.__func__)))
+        else:
+            setattr(package, name, logger(func))
 [_log_package(package) for package in (meta, MetaTable, Table)]
+if interval:
+    dump_periodically(interval)
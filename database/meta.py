@@ -1,8 +1,9 @@
 import re
+from collections import defaultdict
 from types import MappingProxyType
-from typing import Iterable
+from typing import ForwardRef, Iterable, get_args, get_origin
 
-from fields import Field, TablesAttitude as TA
+from fields import Field, TablesAttitude as TA, identifier
 from constraints import Constraint, Unique
 
 
@@ -10,7 +11,7 @@ class MetaTable(type):
     def __init__(cls, clsname, superclasses, attributedict): 
         if clsname == 'Table': return
         
-        _switch_field_types(cls, clsname)
+        _register(cls, clsname)
         cls.table = _clstable(clsname)
 
         fields = {}
@@ -21,15 +22,31 @@ class MetaTable(type):
             fields[_clstable(key)] = field
         cls.fields = MappingProxyType(fields)
 
-def _switch_field_types(cls, tabname):
-    tables = (table for table in Table.subtables() if table.__name__ != tabname)
-    for table in tables:
-        for field in table.fields.values():
-            try: type = field.type.__args__[0]
-            except: type = field.type
+_tables: dict[str, 'Table'] = {}
+_pending: dict[str, list[Field]] = defaultdict(list)
+def _register(cls, clsname):
+    """Adds the table to the registry and resolves string annotations,
+    which are waiting for the class"""
+    _tables[clsname] = cls
+    for field in _pending.pop(clsname, ()):
+        field.__dict__['type'] = cls
+
+def _resolve(field: Field):
+    """Replaces string type of the field by the table, 
+    or the field waits for the table if it isn't created yet"""
+    if type(field.type) is not str: return
+    if table := _tables.get(field.type):
+        field.__dict__['type'] = table
+    else:
+        _pending[field.type].append(field)
+
+def unresolved() -> list[str]:
+    """Returns names of tables, which are used in annotations, but weren't created"""
+    return list(_pending)
 
-            if type == tabname: 
-                field.__dict__['type'] = cls
+def association(table, other) -> str:
+    """Returns name of the table, which links ManyToMany tables"""
+    return identifier('_'.join(sorted((table.table, other.table))))
 
 def _clstable(clstable: str) -> str:
     if table := re.findall(r'[A-Z][a-z]+', clstable):
@@ -42,12 +59,13 @@ def _field_handle(table, clsname, name, field: Field, type_: type | str):
     is_table = _is_table(type_)
     type_in_iter = _type_iter_table(type_)
     sql_type = field.sql_type
-    field.__dict__['type'] = type_in_iter if type_in_iter else type_
+    field.__dict__['type'] = type_in_iter if type_in_iter else _forward(type_)
 
     if is_table or type_in_iter and field.attitude is TA.Simple:
         name += '_id'
         sql_type = 'INT'
-        linked_field = _linked_field(clsname, field)
+        _resolve(field)
+        linked_field = _linked_field(table, field)
         attitudes = _attitudes_tab_field(table, field, linked_field) if is_table \
                else _attitudes_iter_field(linked_field)
 
@@ -60,22 +78,25 @@ def _field_handle(table, clsname, name, field: Field, type_: type | str):
     field.__dict__['name'] = name
     field.__dict__['sql_type'] = sql_type
 
-def _linked_field(clsname, field: Field) -> Field | None:
-    if type(field.type) is str: return 
+def _linked_field(table, field: Field) -> Field | None:
+    if type(field.type) is str or field.type is table: return 
     
     for linked_field in field.type.fields.values():
-        try: type_ = linked_field.type.__args__[0]
-        except: type_ = linked_field.type
-        if _is_table(type_) and type_.__name__ == clsname:
+        if linked_field.type is table:
             return linked_field
 
 def _is_table(type_) -> bool:
-    return type(type_) == str or issubclass(type_, Table)
+    type_ = _forward(type_)
+    return type(type_) is str or isinstance(type_, type) and issubclass(type_, Table)
+
+def _forward(type_):
+    return type_.__forward_arg__ if type(type_) is ForwardRef else type_
 
 def _type_iter_table(type_):
-    is_sequence = type_ is not str and issubclass(type(type_()), Iterable)
-    if is_sequence and _is_table(type_.__args__[0]):
-        return type_.__args__[0]
+    origin, args = get_origin(type_), get_args(type_)
+    is_sequence = isinstance(origin, type) and issubclass(origin, Iterable)
+    if is_sequence and args and _is_table(args[0]):
+        return _forward(args[0])
 
 
 def _attitudes_tab_field(table, field, linked_field) -> tuple[TA] | tuple[TA, TA]:
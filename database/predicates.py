@@ -0,0 +1,129 @@
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Hashable, Iterable, Iterator, TypeAlias
+
+
+column: TypeAlias = tuple[str, str | None]
+Resolver: TypeAlias = Callable[[str], column]
+class Predicate(ABC):
+    """Condition of select, SQL of predicate depends only on its shape,
+    values are passed as parameters
+
+        Item.select('name', price=Between(10, 20))
+        Item.select('name', Or(price=Lt(10), name=['sword', 'bow']))"""
+    @abstractmethod
+    def shape(self) -> Hashable:
+        """Structure of predicate without values"""
+
+    @abstractmethod
+    def sql(self, column: column | None, resolve: Resolver, numbers: Iterator[int]) -> str:
+        """Returns condition for column, names of fields are resolved to columns
+        by resolve, parameters are numbered by numbers"""
+
+    @abstractmethod
+    def values(self) -> list[Any]:
+        """Returns parameters in the order of their numbers"""
+
+def predicate(value: Any) -> Predicate:
+    return value if isinstance(value, Predicate) else Eq(value)
+
+def is_iterable(value: Any) -> bool:
+    return issubclass(type(value), Iterable) and not isinstance(value, (str, bytes))
+
+def _column(column: column | None) -> column:
+    if column is None:
+        raise ValueError("Predicate of values must be passed by name of field")
+    return column
+
+
+class Eq(Predicate):
+    """Equality to the value, to one of values of iterable or IS NULL for None"""
+    def __init__(self, value: Any):
+        self.value = value
+
+    def shape(self) -> Hashable:
+        if self.value is None: return 'null'
+        return '=', is_iterable(self.value)
+
+    def sql(self, column: column, resolve: Resolver, numbers: Iterator[int]) -> str:
+        name, sql_type = _column(column)
+        if self.value is None:
+            return f'{name} IS NULL'
+        elif is_iterable(self.value):
+            array = f'::{sql_type}[]' if sql_type else ''
+            return f'{name} = ANY(${next(numbers)}{array})'
+        return f'{name} = ${next(numbers)}'
+
+    def values(self) -> list[Any]:
+        if self.value is None: return []
+        return [list(self.value)] if is_iterable(self.value) else [self.value]
+
+class Compare(Predicate):
+    operator: str
+
+    def __init__(self, value: Any):
+        self.value = value
+
+    def shape(self) -> Hashable:
+        return self.operator
+
+    def sql(self, column: column, resolve: Resolver, numbers: Iterator[int]) -> str:
+        return f'{_column(column)[0]} {self.operator} ${next(numbers)}'
+
+    def values(self) -> list[Any]:
+        return [self.value]
+
+class Ne(Compare): operator = '<>'
+class Lt(Compare): operator = '<'
+class Le(Compare): operator = '<='
+class Gt(Compare): operator = '>'
+class Ge(Compare): operator = '>='
+
+class Between(Predicate):
+    """Value in range from low to high inclusive"""
+    def __init__(self, low: Any, high: Any):
+        self.low, self.high = low, high
+
+    def shape(self) -> Hashable:
+        return 'between'
+
+    def sql(self, column: column, resolve: Resolver, numbers: Iterator[int]) -> str:
+        return f'{_column(column)[0]} BETWEEN ${next(numbers)} AND ${next(numbers)}'
+
+    def values(self) -> list[Any]:
+        return [self.low, self.high]
+
+class Not(Predicate):
+    def __init__(self, value: Any):
+        self.predicate = predicate(value)
+
+    def shape(self) -> Hashable:
+        return 'not', self.predicate.shape()
+
+    def sql(self, column: column | None, resolve: Resolver, numbers: Iterator[int]) -> str:
+        return f'NOT ({self.predicate.sql(column, resolve, numbers)})'
+
+    def values(self) -> list[Any]:
+        return self.predicate.values()
+
+class And(Predicate):
+    """Predicates are applied to the column of the field,
+    predicates passed by names are applied to the named fields"""
+    operator = 'AND'
+
+    def __init__(self, *predicates: Any, **fields: Any):
+        self.predicates = [(None, predicate(p)) for p in predicates] + \
+                          [(name, predicate(p)) for name, p in fields.items()]
+
+    def shape(self) -> Hashable:
+        return self.operator, tuple((name, p.shape()) for name, p in self.predicates)
+
+    def sql(self, column: column | None, resolve: Resolver, numbers: Iterator[int]) -> str:
+        sql = [p.sql(resolve(name) if name else column, resolve, numbers)
+               for name, p in self.predicates]
+        return '('+f' {self.operator} '.join(sql)+')'
+
+    def values(self) -> list[Any]:
+        return [value for _, p in self.predicates for value in p.values()]
+
+class Or(And):
+    operator = 'OR'
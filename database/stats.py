@@ -0,0 +1,37 @@
+from dataclasses import dataclass, field
+
+
+_octaves, _steps = 40, 4
+def _bucket(elapsed: int) -> int:
+    """Buckets split every power of two of nanoseconds into four steps"""
+    octave = elapsed.bit_length()
+    step = elapsed >> octave-3 & 3 if octave > 3 else 0
+    return min(octave*_steps+step, _octaves*_steps-1)
+
+def _upper(bucket: int) -> int:
+    octave, step = divmod(bucket, _steps)
+    return 5+step << octave-3 if octave > 3 else 2**octave
+
+@dataclass
+class CallStats:
+    """Calls of the function, histogram counts them by quarters of powers of two 
+    of nanoseconds"""
+    calls: int = 0
+    errors: int = 0
+    time: float = 0.0
+    histogram: list[int] = field(default_factory=lambda: [0]*_octaves*_steps)
+
+    def add(self, elapsed: int, error: bool = False):
+        self.calls += 1
+        self.errors += error
+        self.time += elapsed/1e9
+        self.histogram[_bucket(elapsed)] += 1
+
+    def percentile(self, percent: float) -> float:
+        """Returns upper bound of time of the percent of calls in seconds"""
+        count = self.calls*percent/100
+        for bucket, calls in enumerate(self.histogram):
+            count -= calls
+            if calls and count <= 0:
+                return _upper(bucket)/1e9
+        return 0.0
@@ -1,64 +1,457 @@
+import base64
+import datetime
+import functools
+import itertools
+import json
 from collections import defaultdict, namedtuple
-from typing import Any, Iterable
+from decimal import Decimal
+from operator import itemgetter
+from typing import Any, AsyncIterable, AsyncIterator, Callable, Iterable, Iterator
+from uuid import UUID
 
-from functions import Row, fetch
-from meta import Table
+import cache
+from cache import Cache
+from functions import Row, copy_records, current_session, cursor, execute, execute_chunks, \
+                      fetch, fetch_chunks, fetchone
+from meta import Table, association
+from constraints import Trade, Unique
 from fields import Field, TablesAttitude as TA
+from predicates import Predicate, column, predicate
 
 
+Filters = list[tuple[str | None, Predicate]]
+Plan = namedtuple('Plan', 'query columns keys key row Key Row')
+CacheInfo = namedtuple('CacheInfo', 'hits misses size')
+class Plans(dict):
+    """Compiled selects of one table, keyed on the select shape"""
+    hits = misses = 0
+
+    def info(self) -> CacheInfo:
+        return CacheInfo(self.hits, self.misses, len(self))
+
+def _evicts(method):
+    """Evicts caches, which read the table, after the write,
+    so the worker reads own writes before the notification comes"""
+    @functools.wraps(method)
+    async def wrapper(cls, *args, **kwargs):
+        try:
+            return await method(cls, *args, **kwargs)
+        finally:
+            for table in cache.tables(cls):
+                cache.evict(table)
+    return wrapper
+
 class Table(Table):
+    __cache__: Cache | None = None
+
     @classmethod
     async def select(cls, arg: str = None, *args: str, **kwargs: Any) -> list[Row] | dict[Row, Row]:
+        plan, values = cls._plan(arg, args, kwargs)
+        output = await cls._fetch(plan, values)
+        return cls._keys_handle(plan, output)
+
+    @classmethod
+    async def select_nested(cls, arg: str = None, *args: str, **kwargs: Any) -> list[Row]:
+        """Same as select, but rows of OneToMany and ManyToMany fields are 
+        aggregated by the database into list of mappings in the row of the table"""
+        plan, values = cls._plan(arg, args, kwargs, nested=True)
+        return await cls._fetch(plan, values)
+
+    @classmethod
+    async def select_columns(cls, arg: str = None, *args: str, **kwargs: Any) -> dict[str, list]:
+        """Same as select, but returns lists of values for every column"""
+        plan, values = cls._plan(arg, args, kwargs)
+        output = await cls._fetch(plan, values)
+        values = zip(*output) if output else ((),)*len(plan.columns)
+        return dict(zip(plan.columns, map(list, values)))
+
+    @classmethod
+    async def stream(
+            cls, arg: str = None, *args: str, prefetch: int = 100, **kwargs: Any
+            ) -> AsyncIterator[Row | tuple[Row, list[Row]]]:
+        """Same as select, but yields rows one by one from server-side cursor,
+        grouped rows are yielded as (key, rows) when the group is finished"""
+        plan, values = cls._plan(arg, args, kwargs)
+        if not plan.keys:
+            async for row in cursor(plan.query, *values, prefetch=prefetch):
+                yield row
+            return
+
+        query = plan.query+'\nORDER BY '+', '.join(plan.keys)
+        get_key, get_row, Row = plan.key, plan.row, plan.Row._make
+        key, group = None, []
+        async for record in cursor(query, *values, prefetch=prefetch):
+            record_key = get_key(record)
+            if group and record_key != key:
+                yield plan.Key._make(key), group
+                group = []
+            key = record_key
+            group.append(Row(get_row(record)))
+        if group: yield plan.Key._make(key), group
+
+    @classmethod
+    async def select_page(
+            cls, arg: str = None, *args: str, after: str | None = None, limit: int = 50,
+            order_by: str | Iterable[str] = (), **kwargs: Any
+            ) -> tuple[list[Row], str | None]:
+        """Same as select, but returns limit rows after the token, 
+        which was returned with the previous page, and token of the next page.
+        Rows are ordered by the unique key of the table, its id or the first Unique,
+        which is covered by the index of the primary key or the unique constraint.
+        order_by fields are put before the key, they must be not null,
+        because rows with NULL aren't compared, and pages are read by index 
+        only if Index of order_by fields and the key is declared"""
+        if isinstance(order_by, str): order_by = order_by.split()
+        order_by = tuple(order_by)
+        for name in order_by:
+            if name not in cls.fields:
+                raise ValueError(f"I can't order by unknown field {name}")
+            if _nullable(cls.fields[name]):
+                raise ValueError(f"I can't page by nullable field {name}, declare it not null")
+        order_by += tuple(column for column in cls._unique_key() if column not in order_by)
+        plan, values = cls._plan(arg, args, kwargs, order_by, after is not None)
+        if after is not None:
+            values += json.loads(base64.urlsafe_b64decode(after), object_hook=_decode)
+        output = await fetch(plan.query, *values, limit)
+
+        token = None
+        if len(output) == limit:
+            token = json.dumps([output[-1][name] for name in order_by], default=_encode)
+            token = base64.urlsafe_b64encode(token.encode()).decode()
+        return output, token
+
+    @classmethod
+    def _unique_key(cls) -> tuple[str, ...]:
+        """Returns columns of id of the table, if it's created, 
+        or of the first unique constraint of not null fields"""
+        linked = any(f.type is cls and f.attitude in (TA.OneToOne, TA.ManyToOne)
+                     for table in Table.subtables() for f in table.fields.values())
+        if linked or any(f.attitude in (TA.OneToMany, TA.ManyToMany) for f in cls.fields.values()):
+            return (f'{cls.table}_id',)
+        for constraint in cls.__constraints__:
+            if isinstance(constraint, Unique) and not any(map(_nullable, constraint)):
+                return tuple(field.name for field in constraint)
+        raise ValueError(f"I can't page {cls.table} without unique key, "
+                         "declare Unique of not null fields")
+
+    @classmethod
+    async def _fetch(cls, plan: Plan, values: list[Any]) -> list[Row]:
+        """Fetches rows through the cache of the table, if it's declared,
+        the cache isn't used in session, because it can see uncommitted writes.
+        Rows are cached as tuple and returned as new list, so callers can change it"""
+        cache_ = cls.__cache__
+        if not cache_ or not cache.listening() or current_session() \
+           or (key := cache.key(plan.query, values)) is None:
+            return await fetch(plan.query, *values)
+        if (output := cache_.get(key)) is None:
+            generation = cache_.generation
+            output = await fetch(plan.query, *values)
+            cache_.put(key, tuple(output), generation)
+            return output
+        return list(output)
+
+    @classmethod
+    def plan_cache_info(cls) -> CacheInfo:
+        return cls._plans().info()
+
+    @classmethod
+    def _plans(cls) -> Plans:
+        if '_select_plans' not in cls.__dict__:
+            cls._select_plans = Plans()
+        return cls._select_plans
+
+    @classmethod
+    def _plan(
+            cls, arg: str | Predicate | None, args: tuple[str | Predicate], kwargs: dict[str, Any], 
+            order_by: tuple[str] = (), after: bool = False, nested: bool = False
+            ) -> tuple[Plan, list[Any]]:
+        """Returns compiled select and values of its parameters"""
+        predicates = [a for a in (arg, *args) if isinstance(a, Predicate)]
+        if predicates:
+            arg, *args = [a for a in (arg, *args) if not isinstance(a, Predicate)] or [None]
+            args = tuple(args)
+        filters = _filters(predicates, kwargs)
+
+        shape = arg, args, tuple((n, p.shape()) for n, p in filters), order_by, after, nested
+        plans = cls._plans()
+        if plan := plans.get(shape):
+            plans.hits += 1
+        else:
+            plans.misses += 1
+            plan = plans[shape] = cls._compile(arg, args, filters, order_by, after, nested)
+        return plan, [value for _, p in filters for value in p.values()]
+
+    @classmethod
+    def _compile(
+            cls, arg: str | None, args: tuple[str], filters: Filters, 
+            order_by: tuple[str] = (), after: bool = False, nested: bool = False
+            ) -> Plan:
         if not arg and not args:
             fields = cls.fields
         else:
             names = args+(arg,) if arg and args else arg.split()
             fields = {name: cls.fields[name.split('.')[0]] for name in names}
 
-        data = args, keys, params, joins = tuple(map(set, ((),)*4))
+        keys, params, joins = set(), {}, set()
         for name, field in fields.items():
-            cls._field_handle(name, field, *data)
-        where = cls._where(kwargs, args, joins)
+            if nested and field.attitude in (TA.OneToMany, TA.ManyToMany):
+                params[name.split('.')[0]] = cls._aggregate(name, field)
+            else:
+                cls._field_handle(name, field, keys, params, joins)
+        for name in order_by:
+            if name not in cls.fields:
+                params.setdefault(name, f'{cls.table}.{name}')
+                continue
+            if cls.fields[name].attitude is not TA.Simple:
+                raise ValueError(f"I can't order by relation field {name}")
+            cls._field_handle(name, cls.fields[name], keys, params, joins)
+        numbers = itertools.count(1)
+        where = cls._where(filters, joins, numbers)
+        if nested and joins & {cls._join(f.type, f) for f in cls.fields.values() 
+                               if f.attitude in (TA.OneToMany, TA.ManyToMany)}:
+            raise ValueError("I can't filter nested select by rows of aggregated table")
+        columns = tuple(params)
+        keys = tuple(name for name in columns if name in keys) if not nested else ()
+        if order_by and keys:
+            raise ValueError("I can't page grouped rows")
+
+        order = ''
+        if order_by:
+            order = ', '.join(f'{cls.table}.{name}' for name in order_by)
+            if after:
+                after = ', '.join(f'${next(numbers)}' for _ in order_by)
+                where.append(f'({order}) > ({after})')
+            order = f'\nORDER BY {order} LIMIT ${next(numbers)}'
 
-        params = ', '.join(params)
+        params = ', '.join(params.values())
         joins = '\n'+'\n'.join(joins) if joins else ''
-        where = '\nWHERE '+', '.join(where) if where else ''
-        query = f'SELECT {params} FROM {cls.table} '+joins+where
+        where = '\nWHERE '+' AND '.join(where) if where else ''
+        query = f'SELECT {params} FROM {cls.table} '+joins+where+order
+        return Plan(query, columns, keys, *_grouping(columns, keys))
+    
+    @classmethod
+    @_evicts
+    async def insert(cls, returning: str | Iterable[str] = (), **kwargs: Any) -> Row | None:
+        columns = cls._columns(kwargs)
+        params = ', '.join(f'${n}' for n in range(1, len(columns)+1))
+        query = f'INSERT INTO {cls.table}({", ".join(columns.values())}) VALUES({params})' \
+                if columns else f'INSERT INTO {cls.table} DEFAULT VALUES'
+        if not returning:
+            await execute(query, *(kwargs[key] for key in columns))
+            return
+        return await fetchone(query+_returning(returning), *(kwargs[key] for key in columns))
+
+    @classmethod
+    @_evicts
+    async def update(cls, values: Row, *predicates: Predicate, **kwargs: Any) -> int | None:
+        """Sets values to rows, which match filters, returns count of updated rows 
+        or None if the update was queued by session
+
+            Country.update({'balance': 100}, name='Russia')"""
+        columns = cls._columns(values)
+        if not columns:
+            raise ValueError("I can't update rows without values")
+        numbers = itertools.count(1)
+        sets = ', '.join(f'{name} = ${next(numbers)}' for name in columns.values())
+        where, values_ = cls._write_where(predicates, kwargs, numbers)
+        return await execute(f'UPDATE {cls.table} SET {sets}'+where,
+                             *(values[key] for key in columns), *values_)
+
+    @classmethod
+    @_evicts
+    async def delete(cls, *predicates: Predicate, **kwargs: Any) -> int | None:
+        """Deletes rows, which match filters, returns count of deleted rows
+        or None if the delete was queued by session"""
+        where, values = cls._write_where(predicates, kwargs, itertools.count(1))
+        return await execute(f'DELETE FROM {cls.table}'+where, *values)
+
+    @classmethod
+    @_evicts
+    async def purchase(cls, country: int, item: int, count: int = 1) -> Row | None:
+        """Buys count of the item for the country with the server function of Trade,
+        returns new balance and count or None if the country can't afford it"""
+        return await fetchone(f'SELECT * FROM {cls._trade()}_purchase($1, $2, $3)', 
+                              country, item, count)
+
+    @classmethod
+    @_evicts
+    async def sell(cls, country: int, item: int, count: int = 1) -> Row | None:
+        """Returns new balance and count or None if the country hasn't enough items"""
+        return await fetchone(f'SELECT * FROM {cls._trade()}_sell($1, $2, $3)', 
+                              country, item, count)
+
+    @classmethod
+    @_evicts
+    async def consume(cls, country: int, item: int, count: int = 1) -> Row | None:
+        """Returns new count or None if the country hasn't enough items"""
+        return await fetchone(f'SELECT * FROM {cls._trade()}_consume($1, $2, $3)', 
+                              country, item, count)
+
+    @classmethod
+    def _trade(cls) -> str:
+        if not any(isinstance(c, Trade) for c in cls.__constraints__):
+            raise ValueError(f"I can't trade with {cls.table}, it hasn't Trade constraint")
+        return cls.table
+
+    @classmethod
+    def _write_where(cls, predicates: tuple[Predicate], kwargs: dict[str, Any], 
+                     numbers: Iterator[int]) -> tuple[str, list[Any]]:
+        filters, joins = _filters(predicates, kwargs), set()
+        where = cls._where(filters, joins, numbers)
+        if joins:
+            raise ValueError("I can't change rows filtered by fields of linked tables")
+        where = '\nWHERE '+' AND '.join(where) if where else ''
+        return where, [value for _, p in filters for value in p.values()]
+
+    @classmethod
+    @_evicts
+    async def insert_many(
+            cls, rows: Iterable[Row] | AsyncIterable[Row], 
+            returning: str | Iterable[str] = (), chunk: int = 10_000
+            ) -> int | list[Row]:
+        """Insert rows by chunks with COPY, 
+        if returning is given rows are inserted with INSERT ... RETURNING,
+        chunks are inserted in one transaction"""
+        chunks = _chunks(rows, chunk)
+        try: first = await anext(chunks)
+        except StopAsyncIteration: return [] if returning else 0
+        columns = cls._columns(first[0])
+
+        async def records() -> AsyncIterator[list[tuple]]:
+            yield [tuple(row[key] for key in columns) for row in first]
+            async for rows in chunks:
+                yield [tuple(row[key] for key in columns) for row in rows]
+        if not returning:
+            return await copy_records(cls.table, list(columns.values()), records())
+
+        params = ', '.join(f'${n}::{cls.fields[key].sql_type}[]' 
+                           for n, key in enumerate(columns, 1))
+        query = f'INSERT INTO {cls.table}({", ".join(columns.values())}) '\
+                f'SELECT * FROM unnest({params})'+_returning(returning)
+        async def arrays() -> AsyncIterator[list[list]]:
+            async for records_ in records():
+                yield list(map(list, zip(*records_)))
+        return await fetch_chunks(query, arrays())
+
+    @classmethod
+    @_evicts
+    async def update_many(
+            cls, rows: Iterable[Row] | AsyncIterable[Row], 
+            key: str | Iterable[str] = None, chunk: int = 10_000
+            ) -> int:
+        """Sets values of rows to rows of the table with the same key 
+        by one UPDATE ... FROM unnest for each chunk in one transaction, 
+        returns count of updated rows. Key is id of the table by default
+
+            Country.update_many([{'name': 'Russia', 'balance': 100}, ...], key='name')"""
+        keys = cls._keys(key)
+        chunks = _chunks(rows, chunk)
+        try: first = await anext(chunks)
+        except StopAsyncIteration: return 0
+        columns = cls._columns({k: v for k, v in first[0].items() if k not in keys})
+        if not columns:
+            raise ValueError("I can't update rows without values")
+
+        names = {**{k: column for k, (column, _) in keys.items()}, **columns}
+        types = [sql_type for _, sql_type in keys.values()]
+        types += [cls.fields[key].sql_type for key in columns]
+        params = ', '.join(f'${n}::{sql_type}[]' for n, sql_type in enumerate(types, 1))
+        sets = ', '.join(f'{column} = _rows.{column}' for column in columns.values())
+        where = ' AND '.join(f'{cls.table}.{column} = _rows.{column}' 
+                             for column, _ in keys.values())
+        query = f'UPDATE {cls.table} SET {sets}\n'\
+                f'FROM unnest({params}) AS _rows({", ".join(names.values())})\n'\
+                f'WHERE {where}'
 
-        values = []
-        for value in kwargs.values():
-            if issubclass(type(value), Iterable):
-                values += list(value)
+        async def arrays() -> AsyncIterator[list[list]]:
+            yield [list(c) for c in zip(*(tuple(row[k] for k in names) for row in first))]
+            async for rows in chunks:
+                yield [list(c) for c in zip(*(tuple(row[k] for k in names) for row in rows))]
+        return await execute_chunks(query, arrays())
+
+    @classmethod
+    @_evicts
+    async def delete_many(
+            cls, keys: Iterable | AsyncIterable, 
+            key: str | Iterable[str] = None, chunk: int = 10_000
+            ) -> int:
+        """Deletes rows with keys by one DELETE for each chunk in one transaction,
+        returns count of deleted rows. Keys of several fields are passed as tuples
+
+            Ware.delete_many([1, 2, 3])
+            Inventory.delete_many([(country_id, item_id), ...], key='country item')"""
+        columns = cls._keys(key)
+        params = [f'${n}::{sql_type}[]' for n, (_, sql_type) in enumerate(columns.values(), 1)]
+        names = [f'{cls.table}.{column}' for column, _ in columns.values()]
+        if len(columns) == 1:
+            where = f'{names[0]} = ANY({params[0]})'
+        else:
+            where = f'({", ".join(names)}) IN (SELECT * FROM unnest({", ".join(params)}))'
+
+        async def arrays() -> AsyncIterator[list[list]]:
+            async for keys_ in _chunks(keys, chunk):
+                yield [keys_] if len(columns) == 1 else [list(c) for c in zip(*keys_)]
+        return await execute_chunks(f'DELETE FROM {cls.table} WHERE {where}', arrays())
+
+    @classmethod
+    def _keys(cls, key: str | Iterable[str] | None) -> dict[str, tuple[str, str]]:
+        """Returns columns and their types for names of key fields"""
+        if key is None: key = f'{cls.table}_id'
+        keys = {}
+        for name in key.split() if isinstance(key, str) else key:
+            if name == f'{cls.table}_id':
+                keys[name] = name, 'INT'
+            elif field := cls.fields.get(name):
+                keys[name] = field.name, field.sql_type
             else:
-                values.append(value)
-        output = await fetch(query, *values) 
-        return cls._keys_handle(args, keys, output)
-    
+                raise ValueError(f"I can't find field {name}")
+        return keys
+
+    @classmethod
+    def _columns(cls, row: Row) -> dict[str, str]:
+        """Returns names of columns for keys of row, 
+        which can be inserted into the table"""
+        columns = {}
+        for key in row:
+            if not (field := cls.fields.get(key)): 
+                raise ValueError(f"I can't find field {key}")
+            generated = field.generated and field.generated.generation == 'ALWAYS'
+            if generated or field.attitude in (TA.OneToMany, TA.ManyToMany):
+                continue
+            columns[key] = field.name
+        return columns
+
     @classmethod
-    def _field_handle(cls, name, field, args, keys, params, joins):
+    def _field_handle(cls, name, field, keys, params, joins):
         if field.attitude is TA.Simple:
-            args.add(name)
-            params.add(name)
+            params[name] = f'{cls.table}.{name}'
         else:
             table = field.type
-            name = name.split('.')
-            if len(name) == 1:
-                fields = tuple(n for n, f in table.fields.items() 
-                               if f.attitude is TA.Simple)
-            else:
-                assert table.fields[name[1]].attitude is TA.Simple
-                fields = (name[1],)
-
-            args.update(table.table+'_'+f for f in fields)
-            params.update('{0}.{1} AS {0}_{1}'.format(table.table, n) 
+            fields = _joined_fields(table, name)
+            params.update((f'{table.table}_{n}', f'{table.table}.{n} AS {table.table}_{n}')
                           for n in fields)
             if key := cls._key(table, field, fields):
                 keys.update(key)
             joins.add(cls._join(table, field))
 
     @classmethod
-    def _key(cls, table: Table, field: Field, fields) -> Iterable[str] | None:
+    def _aggregate(cls, name: str, field: Field) -> str:
+        """Returns subquery, which aggregates rows of OneToMany or ManyToMany field 
+        into jsonb array for each row of the table"""
+        table = field.type
+        values = ', '.join(f"'{n}', {table.table}.{n}" for n in _joined_fields(table, name))
         if field.attitude is TA.OneToMany:
+            source = f'{table.table} WHERE {table.table}.{cls.table}_id'
+        else:
+            association_ = association(cls, table)
+            source = f'{association_} JOIN {table.table} USING({table.table}_id) '\
+                     f'WHERE {association_}.{cls.table}_id'
+        return f"(SELECT COALESCE(jsonb_agg(jsonb_build_object({values})), '[]') "\
+               f"FROM {source} = {cls.table}.{cls.table}_id) AS {name.split('.')[0]}"
+
+    @classmethod
+    def _key(cls, table: Table, field: Field, fields) -> Iterable[str] | None:
+        if field.attitude in (TA.OneToMany, TA.ManyToMany):
             return (n for n, f in cls.fields.items() if f.attitude is TA.Simple)
         elif field.attitude is TA.ManyToOne:
             return (table.table+'_'+f for f in fields)
@@ -69,6 +462,10 @@ class Table(Table):
             join = 'LEFT JOIN', f'{table.table}_id'
         elif field.attitude is TA.OneToMany:
             join = 'LEFT JOIN', f'{cls.table}_id'
+        elif field.attitude is TA.ManyToMany:
+            association_ = association(cls, table)
+            return f'LEFT JOIN {association_} USING({cls.table}_id)\n'\
+                   f'LEFT JOIN {table.table} USING({table.table}_id)'
         else:
             join = 'RIGHT JOIN', f'{table.table}_id'
         join_form = '{}'+f' {table.table} '+'USING({})'
@@ -76,40 +473,105 @@ class Table(Table):
 
 
     @classmethod
-    def _where(cls, kwargs, args, joins) -> set[str]:
-        where = set()
-        for name, value in kwargs.items():
-            field = ''
-            for field in cls.fields.keys():
-                if field == name: break
-                elif name.startswith(field+'_'):
-                    field = '.'.join((field, name.replace(field+'_', '')))
-                    break
-            else: raise ValueError(f"I can't find field {name}")
-            number = len(where)+1
-            if not issubclass(type(value), Iterable):
-                where.add(f'{field} = ${number}')
-            else:
-                where_ = ', '.join(f'${n}' for n in range(number, len(value)+1))
-                where_ = f'({where_})'
-                where.add(f'{field} IN {where_}')
-            if name in args: continue
-            else:
-                field = field.split('.')[0]
-                field = cls.fields[field]
+    def _where(cls, filters: Filters, joins, numbers: Iterator[int]) -> list[str]:
+        resolve = lambda name: cls._column(name, joins)
+        return [p.sql(name and resolve(name), resolve, numbers) for name, p in filters]
+
+    @classmethod
+    def _column(cls, name: str, joins) -> column:
+        """Returns column and its type for name of filter, which is name of field,
+        of column of the table or of field of linked table after name of the linking field,
+        the table of column is added to joins if it's needed"""
+        if field := cls.fields.get(name):
+            return f'{cls.table}.{field.name}', field.sql_type
+        if name == f'{cls.table}_id':
+            return f'{cls.table}.{name}', 'INT'
+        for field in cls.fields.values():
+            if field.name == name and field.attitude in (TA.OneToOne, TA.ManyToOne):
+                return f'{cls.table}.{field.name}', field.sql_type
+        for key, field in cls.fields.items():
+            if field.attitude is not TA.Simple and name.startswith(key+'_') \
+               and (linked := field.type.fields.get(name.removeprefix(key+'_'))):
                 joins.add(cls._join(field.type, field))
-        return where
+                return f'{field.type.table}.{linked.name}', linked.sql_type
+        raise ValueError(f"I can't find field {name}")
 
     @classmethod
-    def _keys_handle(cls, args, keys, output):
-        if keys := args & keys:
+    def _keys_handle(cls, plan: Plan, output):
+        if plan.keys:
             output_ = defaultdict(list)
-            KeyRecord = namedtuple('Record', keys)
-            RowRecord = namedtuple('Record', args-keys)
-            for row in output:
-                row = dict(row)
-                key = KeyRecord(*(row.pop(key) for key in keys))
-                row = RowRecord(*row.values())
-                output_[key].append(row)
-            output = dict(output_)
+            get_key, get_row, Row = plan.key, plan.row, plan.Row._make
+            for record in output:
+                output_[get_key(record)].append(Row(get_row(record)))
+            Key = plan.Key._make
+            output = {Key(key): rows for key, rows in output_.items()}
         return output
+
+
+def _filters(predicates: Iterable[Predicate], kwargs: dict[str, Any]) -> Filters:
+    return [(None, p) for p in predicates]+\
+           [(name, predicate(value)) for name, value in kwargs.items()]
+
+def _nullable(field: Field) -> bool:
+    identity = field.generated and field.generated.type == 'IDENTITY'
+    return not field.not_null and not identity
+
+def _joined_fields(table: Table, name: str) -> tuple[str]:
+    """Returns simple fields of joined table, which were selected by name"""
+    name = name.split('.')
+    if len(name) == 1:
+        return tuple(n for n, f in table.fields.items() if f.attitude is TA.Simple)
+    assert table.fields[name[1]].attitude is TA.Simple
+    return (name[1],)
+
+def _grouping(columns: tuple[str], keys: tuple[str]) -> tuple:
+    """Returns getters of key and row values from record by positions of columns 
+    and types of key and row records"""
+    if not keys: return None, None, None, None
+    values = tuple(name for name in columns if name not in keys)
+    return _getter(map(columns.index, keys)), _getter(map(columns.index, values)), \
+           namedtuple('Record', keys), namedtuple('Record', values)
+
+def _getter(positions: Iterable[int]) -> Callable[[Row], tuple]:
+    match tuple(positions):
+        case (): return lambda record: ()
+        case (position,): return lambda record: (record[position],)
+        case positions: return itemgetter(*positions)
+
+def _returning(returning: str | Iterable[str]) -> str:
+    if isinstance(returning, str): returning = returning.split()
+    return ' RETURNING '+', '.join(returning) if returning else ''
+
+_token_types = {'datetime': datetime.datetime, 'date': datetime.date, 'time': datetime.time}
+def _encode(value: Any) -> dict:
+    """Values, which JSON doesn't know, are written to tokens with their types"""
+    for name, type_ in _token_types.items():
+        if isinstance(value, type_):
+            return {'$': name, 'value': value.isoformat()}
+    if isinstance(value, Decimal):
+        return {'$': 'decimal', 'value': str(value)}
+    elif isinstance(value, UUID):
+        return {'$': 'uuid', 'value': str(value)}
+    raise TypeError(f"I can't write {type(value).__name__} to token")
+
+def _decode(object_: dict) -> Any:
+    match object_.get('$'):
+        case None: return object_
+        case 'decimal': return Decimal(object_['value'])
+        case 'uuid': return UUID(object_['value'])
+        case name: return _token_types[name].fromisoformat(object_['value'])
+
+async def _chunks(rows: Iterable[Row] | AsyncIterable[Row], size: int) -> AsyncIterator[list[Row]]:
+    if not isinstance(rows, AsyncIterable):
+        rows = _aiter(rows)
+    chunk = []
+    async for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk: yield chunk
+
+async def _aiter(rows: Iterable[Row]) -> AsyncIterator[Row]:
+    for row in rows:
+        yield row
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Modules of the package are imported flat, as they are by main.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,121 @@
+import os
+import shutil
+
+import pytest
+
+import meta
+import table
+from constraints import Index, Unique
+from fields import Field, Generated, Sequence
+from table import Table
+
+
+@pytest.fixture(scope='module')
+def init(tmp_path_factory):
+    """init imports logger, which reads logger.conf from the working directory 
+    and wraps methods of tables, so the log is written aside 
+    and the methods are restored for other tests"""
+    directory = tmp_path_factory.mktemp('init')
+    shutil.copy(os.path.join(os.path.dirname(table.__file__), 'logger.conf'), directory)
+    packages = meta.Table, meta.MetaTable, table.Table
+    originals = [dict(vars(package)) for package in packages]
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        import init
+    finally:
+        os.chdir(cwd)
+    yield init
+    for package, original in zip(packages, originals):
+        for name in set(vars(package))-set(original):
+            delattr(package, name)
+        for name, value in original.items():
+            if vars(package).get(name) is not value:
+                setattr(package, name, value)
+
+
+class MigrationCountry(Table):
+    name: str = Field(not_null=True)
+    balance: float = Field()
+    turn: int = Field(sql_type='SMALLINT', generated=Generated('BY DEFAULT', options=Sequence(5)))
+    wares: list['MigrationWare']
+    __constraints__ = (Unique(name), Index(balance))
+
+class MigrationWare(Table):
+    name: str = Field(sql_type='VARCHAR(20)')
+    price: float = Field(sql_type='NUMERIC(10, 2)', not_null=True)
+    country: MigrationCountry
+
+def column(name, sql_type, not_null=False, identity='', start=None, max=None):
+    return {'name': name, 'sql_type': sql_type, 'not_null': not_null, 'identity': identity,
+            'generated': '', 'expression': None, 'start': start, 'increment': start and 1,
+            'max': max, 'min': start and 1}
+
+# Rows of the catalog query as PostgreSQL returns them for the created tables
+catalog = [{
+    'name': 'migration_country', 
+    'fields': [column('migration_country_id', 'integer', True, 'a', 1, 2147483647),
+               column('name', 'text', True), column('balance', 'double precision'),
+               column('turn', 'smallint', True, 'd', 5, 32767)],
+    'constraints': {'migration_country_name': 'UNIQUE (name)',
+                    'migration_country_pkey': 'PRIMARY KEY (migration_country_id)'},
+    'indexes': {'migration_country_balance_idx': 
+                'CREATE INDEX migration_country_balance_idx '
+                'ON public.migration_country USING btree (balance)'},
+    'populated': True, 'partition': None
+}, {
+    'name': 'migration_ware',
+    'fields': [column('name', 'character varying(20)'), column('price', 'numeric(10,2)', True),
+               column('country_id', 'integer')],
+    'constraints': {'migration_ware_country_id_fkey': 
+                    'FOREIGN KEY (country_id) REFERENCES migration_country(migration_country_id) '
+                    'ON DELETE CASCADE'},
+    'indexes': {'migration_ware_country_id_idx': 
+                'CREATE INDEX migration_ware_country_id_idx '
+                'ON public.migration_ware USING btree (country_id)'},
+    'populated': True, 'partition': None
+}]
+
+def script(init, catalog, drop_columns=False) -> str:
+    schemas = init._schemas([MigrationCountry, MigrationWare])
+    levels = init._levels(schemas)
+    return init._script(*init._migration(schemas, init._created_schemas(catalog), 
+                                         levels, drop_columns))
+
+
+def test_unchanged_catalog_has_empty_migration(init):
+    assert script(init, catalog) == ''
+
+def test_changed_columns_are_altered(init):
+    country, ware = (dict(row) for row in catalog)
+    country['fields'] = country['fields'][:2]+[column('balance', 'integer'), 
+                                               column('kept', 'text')]+country['fields'][3:]
+    ware['fields'] = [column('name', 'character varying(20)'), column('price', 'numeric(10,2)')]
+    assert script(init, [country, ware]) == \
+           '-- level 1\n'\
+           'ALTER TABLE migration_country ALTER COLUMN balance '\
+           'TYPE double precision USING balance::double precision;\n'\
+           '-- level 2\n'\
+           'ALTER TABLE migration_ware ADD COLUMN country_id INT;\n'\
+           'ALTER TABLE migration_ware ALTER COLUMN price SET NOT NULL'
+    assert 'DROP COLUMN kept' in script(init, [country, ware], drop_columns=True)
+
+@pytest.mark.parametrize('declared, created', [
+    ('INT', 'integer'), ('float', 'double precision'), ('NUMERIC(10, 2)', 'numeric(10,2)'),
+    ('TIMESTAMPTZ', 'timestamp with time zone'), ('int[]', 'integer[]'), ('TEXT', 'text')
+])
+def test_sql_type_is_normalized_like_catalog(init, declared, created):
+    assert init._sql_type(declared) == created
+
+def test_cycle_defers_one_foreign_key(init):
+    def schema(name, *references):
+        keys = {f'{name}_{r}_fkey': r for r in references}
+        return init.Schema(name, constraints={k: f'FOREIGN KEY({r}_id) REFERENCES {r}({r}_id)'
+                                              for k, r in keys.items()}, references=keys)
+    schemas = {s.name: s for s in (schema('a', 'c'), schema('b', 'a'), schema('c', 'b'), 
+                                   schema('d', 'a'), schema('e'))}
+    assert init._levels(schemas) == [['e'], ['b'], ['c'], ['a'], ['d']]
+    deferred = [(s.name, key) for s in schemas.values() for key in s.deferred]
+    assert deferred == [('b', 'b_a_fkey')]
+    assert schemas['b'].constraints['b_a_fkey'].endswith('DEFERRABLE INITIALLY DEFERRED')
+    assert sum('DEFERRABLE' in c for s in schemas.values() for c in s.constraints.values()) == 1
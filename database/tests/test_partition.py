@@ -0,0 +1,72 @@
+import datetime
+
+import pytest
+
+from constraints import Partition
+from fields import Field, identifier
+
+
+def test_range_from_partition_of_first_key_to_ahead_of_last():
+    partition = Partition('turn', step=10, ahead=1)
+    assert list(partition.partitions('history')) == ['history_p0', 'history_p1', 'history_default']
+    partitions = partition.partitions('history', last=35, first=12)
+    assert list(partitions) == ['history_p1', 'history_p2', 'history_p3', 'history_p4',
+                                'history_default']
+    assert partitions['history_p3'] == ('FOR VALUES FROM (30) TO (40)', 'turn >= 30 AND turn < 40')
+    assert partitions['history_default'] == ('DEFAULT', None)
+
+def test_range_of_dates():
+    partition = Partition('day', step=datetime.timedelta(days=7),
+                          start=datetime.date(2026, 1, 5), ahead=0)
+    assert partition.partitions('history', last=datetime.date(2026, 1, 13))['history_p1'][0] == \
+           "FOR VALUES FROM ('2026-01-12') TO ('2026-01-19')"
+
+def test_list_with_default():
+    partitions = Partition('kind', 'list', values=('army', "sea fleet's")).partitions('unit')
+    assert partitions == {
+        'unit_army': ("FOR VALUES IN ('army')", "kind = 'army'"),
+        'unit_sea_fleet_s': ("FOR VALUES IN ('sea fleet''s')", "kind = 'sea fleet''s'"),
+        'unit_default': ('DEFAULT', None)
+    }
+
+def test_hash_without_default():
+    partitions = Partition('country_id', 'hash', modulus=2).partitions('inventory')
+    assert partitions == {
+        'inventory_p0': ('FOR VALUES WITH (MODULUS 2, REMAINDER 0)', None),
+        'inventory_p1': ('FOR VALUES WITH (MODULUS 2, REMAINDER 1)', None)
+    }
+
+def test_name_of_field_is_read_lazily():
+    field = Field()
+    partition = Partition(field, step=1)
+    field.__dict__['name'] = 'turn'
+    assert partition.partition == 'RANGE(turn)'
+
+def test_attach_moves_rows_of_default():
+    statements = Partition('turn', step=10).attach('history', 'history_p1',
+                                                   'FOR VALUES FROM (10) TO (20)', 'turn >= 10')
+    assert statements[1].startswith('WITH moved AS (DELETE FROM history_default WHERE turn >= 10')
+    assert statements[-1] == 'ALTER TABLE history ATTACH PARTITION history_p1 '\
+                             'FOR VALUES FROM (10) TO (20)'
+
+@pytest.mark.parametrize('arguments', [{'method': 'range'}, {'method': 'list'},
+                                       {'method': 'hash'}, {'method': 'interval', 'step': 1}])
+def test_incomplete_declaration(arguments):
+    with pytest.raises(ValueError):
+        Partition('turn', **arguments)
+
+def test_long_names_are_shortened_uniquely():
+    long = 'a'*70
+    assert identifier('short') == 'short'
+    assert len(identifier(long+'_p1').encode()) == 63
+    assert identifier(long+'_p1') != identifier(long+'_p2')
+
+def test_attach_long_table_moves_rows_of_shortened_default():
+    table = 'h'*60
+    partition = Partition('turn', step=10)
+    partitions = partition.partitions(table)
+    default = identifier(f'{table}_default')
+    assert default in partitions and len(default) == 63
+    name, (bound, where) = next(iter(partitions.items()))
+    statements = partition.attach(table, name, bound, where)
+    assert statements[1].startswith(f'WITH moved AS (DELETE FROM {default} WHERE turn >= 0')
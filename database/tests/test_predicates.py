@@ -0,0 +1,79 @@
+import itertools
+
+import pytest
+
+from predicates import And, Between, Eq, Ge, Gt, Le, Lt, Ne, Not, Or, Predicate, predicate
+from table import Table
+
+
+columns = {'name': ('item.name', 'TEXT'), 'price': ('item.price', 'INT')}
+def sql(predicate_, column=None, start=1) -> str:
+    return predicate_.sql(column, columns.__getitem__, itertools.count(start))
+
+
+def test_eq():
+    assert sql(Eq(3), columns['price']) == 'item.price = $1'
+    assert sql(Eq(None), columns['price']) == 'item.price IS NULL'
+    assert Eq(None).values() == []
+
+def test_eq_iterable_is_typed_array():
+    assert sql(Eq(('a', 'b')), columns['name']) == 'item.name = ANY($1::TEXT[])'
+    assert Eq(('a', 'b')).values() == [['a', 'b']]
+    assert sql(Eq('ab'), columns['name']) == 'item.name = $1'
+
+@pytest.mark.parametrize('type_, operator', [(Ne, '<>'), (Lt, '<'), (Le, '<='), 
+                                             (Gt, '>'), (Ge, '>=')])
+def test_compare(type_, operator):
+    assert sql(type_(5), columns['price'], 4) == f'item.price {operator} $4'
+    assert type_(5).values() == [5]
+
+def test_between_numbers_both_bounds():
+    assert sql(Between(1, 9), columns['price']) == 'item.price BETWEEN $1 AND $2'
+    assert Between(1, 9).values() == [1, 9]
+
+def test_not():
+    assert sql(Not(Lt(3)), columns['price']) == 'NOT (item.price < $1)'
+    assert sql(Not([1, 2]), columns['price']) == 'NOT (item.price = ANY($1::INT[]))'
+
+def test_and_or_number_parameters_in_order_of_values():
+    or_ = Or(Lt(10), Between(20, 30), name=['sword', 'bow'])
+    assert sql(or_, columns['price']) == \
+           '(item.price < $1 OR item.price BETWEEN $2 AND $3 OR item.name = ANY($4::TEXT[]))'
+    assert or_.values() == [10, 20, 30, ['sword', 'bow']]
+
+    and_ = And(Or(price=Gt(1), name=None), name=Ne('axe'))
+    assert sql(and_) == '((item.price > $1 OR item.name IS NULL) AND item.name <> $2)'
+    assert and_.values() == [1, 'axe']
+
+def test_values_without_name():
+    with pytest.raises(ValueError):
+        sql(Lt(3))
+
+def test_shape_ignores_values():
+    assert Or(price=Lt(1), name=['a']).shape() == Or(price=Lt(9), name=('b', 'c')).shape()
+    assert Eq(1).shape() != Eq([1]).shape() != Eq(None).shape()
+    assert predicate(Lt(1)).shape() == Lt(1).shape()
+
+
+class PredicateItem(Table):
+    name: str
+    price: int
+
+def test_plan_numbers_predicates_and_filters():
+    plan, values = PredicateItem._plan('name', (Or(price=Lt(5), name=['a', 'b']),), 
+                                       {'price': Between(1, 3), 'name': 'c'})
+    assert plan.query.endswith(
+            'WHERE (predicate_item.price < $1 OR predicate_item.name = ANY($2::TEXT[])) '
+            'AND predicate_item.price BETWEEN $3 AND $4 AND predicate_item.name = $5')
+    assert values == [5, ['a', 'b'], 1, 3, 'c']
+
+def test_plan_is_reused_by_shape():
+    first, _ = PredicateItem._plan('name', (), {'price': Lt(1)})
+    second, values = PredicateItem._plan('name', (), {'price': Lt(2)})
+    assert first is second and values == [2]
+
+def test_predicate_without_methods_is_abstract():
+    class Incomplete(Predicate):
+        def shape(self): return 'incomplete'
+    with pytest.raises(TypeError):
+        Incomplete()
@@ -0,0 +1,38 @@
+import random
+
+import pytest
+
+from stats import CallStats, _bucket, _octaves, _steps, _upper
+
+
+def test_bucket_bounds_its_values():
+    values = [*range(1, 5000), *(2**n+d for n in range(4, 38) for d in (-1, 0, 1))]
+    for elapsed in values:
+        bucket = _bucket(elapsed)
+        assert _upper(bucket-1) <= elapsed < _upper(bucket)
+
+def test_bucket_edges():
+    assert [_bucket(n) for n in (0, 1, 2, 3, 4, 7, 8, 9, 10, 11, 12, 15, 16)] == \
+           [0, 4, 8, 8, 12, 12, 16, 16, 17, 17, 18, 19, 20]
+    assert _bucket(2**62) == _octaves*_steps-1
+
+def test_buckets_are_monotonic():
+    buckets = [_bucket(n) for n in range(100_000)]
+    assert buckets == sorted(buckets)
+
+@pytest.mark.parametrize('seed', range(5))
+def test_percentiles_are_monotonic_upper_bounds(seed):
+    generator = random.Random(seed)
+    times = [int(generator.lognormvariate(13, 2)) for _ in range(1000)]
+    stats = CallStats()
+    for elapsed in times:
+        stats.add(elapsed, error=elapsed % 10 == 0)
+    percentiles = [stats.percentile(p) for p in range(1, 101)]
+    assert percentiles == sorted(percentiles)
+    times.sort()
+    for percent in (50, 95, 99, 100):
+        assert stats.percentile(percent) >= times[len(times)*percent//100-1]/1e9
+    assert stats.calls == 1000 and stats.errors == sum(t % 10 == 0 for t in times)
+
+def test_percentile_of_no_calls():
+    assert CallStats().percentile(50) == 0.0
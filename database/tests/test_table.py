@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+
+from constraints import Unique
+from fields import Field
+from table import Table
+
+
+class PageCountry(Table):
+    name: str = Field(not_null=True)
+    balance: int
+    page_wares: list['PageWare']
+
+class PageWare(Table):
+    name: str
+    page_country: PageCountry
+
+class PageItem(Table):
+    name: str = Field(not_null=True)
+    price: int
+    __constraints__ = (Unique(name),)
+
+class PageLog(Table):
+    text: str = Field()
+    __constraints__ = (Unique(text),)
+
+
+def test_page_is_ordered_by_id_by_default():
+    assert PageCountry._unique_key() == ('page_country_id',)
+    plan, _ = PageCountry._plan('name', (), {}, PageCountry._unique_key(), True)
+    assert plan.query.endswith('WHERE (page_country.page_country_id) > ($1)\n'
+                               'ORDER BY page_country.page_country_id LIMIT $2')
+
+def test_page_is_ordered_by_not_null_unique():
+    assert PageItem._unique_key() == ('name',)
+    with pytest.raises(ValueError):
+        PageLog._unique_key()
+
+def test_order_by_is_put_before_key():
+    plan, _ = PageItem._plan('price', (), {}, ('price', 'name'), True)
+    assert plan.query.endswith('WHERE (page_item.price, page_item.name) > ($1, $2)\n'
+                               'ORDER BY page_item.price, page_item.name LIMIT $3')
+
+@pytest.mark.parametrize('order_by', ['balance', 'unknown'])
+def test_page_by_nullable_or_unknown_field(order_by):
+    with pytest.raises(ValueError):
+        asyncio.run(PageCountry.select_page('name', order_by=order_by))
+
+
+def test_filter_by_column_of_link_and_id():
+    plan, values = PageWare._plan('name', (), {'page_country_id': 5, 'page_ware_id': [1, 2]})
+    assert plan.query.endswith('WHERE page_ware.page_country_id = $1 '
+                               'AND page_ware.page_ware_id = ANY($2::INT[])')
+    assert values == [5, [1, 2]]
+
+def test_filter_by_field_of_linked_table():
+    plan, _ = PageWare._plan('name', (), {'page_country_balance': 5})
+    assert 'RIGHT JOIN page_country' in plan.query
+    assert plan.query.endswith('WHERE page_country.balance = $1')
+
+@pytest.mark.parametrize('name', ['unknown', 'page_country_unknown', 'page_country_id_x'])
+def test_filter_by_unknown_name(name):
+    with pytest.raises(ValueError):
+        PageWare._plan('name', (), {name: 5})
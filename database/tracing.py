@@ -0,0 +1,122 @@
+"""Statistics of queries of the functions helpers by normalized statements,
+plans of slow statements are sampled with EXPLAIN and logged,
+selects are explained with ANALYZE and BUFFERS
+
+    tracing.enable()
+    ...
+    print(tracing.report())
+    tracing.dump('queries.json')
+"""
+import asyncio
+import json
+import os
+import re
+import time
+from dataclasses import dataclass
+
+import asyncpg
+
+import functions
+from functions import Trace
+from logger import debug_logger
+from stats import CallStats
+
+
+trace: bool = bool(os.getenv('DATABASE_TRACE'))
+threshold: float = float(os.getenv('DATABASE_TRACE_THRESHOLD', 100))/1000
+explain_interval: float = float(os.getenv('DATABASE_TRACE_EXPLAIN_INTERVAL', 60))
+
+@dataclass
+class QueryStats(CallStats):
+    rows: int = 0
+    wait: float = 0.0
+    explained: float = 0.0
+
+_stats: dict[str, QueryStats] = {}
+def query_stats() -> dict[str, QueryStats]:
+    return dict(_stats)
+
+def reset():
+    _stats.clear()
+
+def enable():
+    if _hook not in functions.hooks:
+        functions.hooks.append(_hook)
+
+def disable():
+    if _hook in functions.hooks:
+        functions.hooks.remove(_hook)
+
+
+_literals = re.compile(r"'(?:[^']|'')*'|(?<![\w$])\d+(?:\.\d+)?\b")
+def normalize(query: str) -> str:
+    """Returns query without literals and extra whitespaces"""
+    return ' '.join(_literals.sub('?', query).split())
+
+def _hook(trace: Trace):
+    statement = normalize(trace.query)
+    stats = _stats.get(statement) or _stats.setdefault(statement, QueryStats())
+    stats.add(int(trace.time*1e9), trace.error)
+    stats.rows += trace.rows
+    stats.wait += trace.wait
+
+    now = time.monotonic()
+    if trace.time >= threshold and not trace.error and trace.explainable \
+       and _explainable(trace.query) \
+       and (not stats.explained or now-stats.explained >= explain_interval):
+        stats.explained = now
+        asyncio.ensure_future(_explain(trace))
+
+def _explainable(query: str) -> bool:
+    return query.lstrip()[:6].upper() in ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')
+
+async def _explain(trace: Trace):
+    """Selects are explained with ANALYZE in the read only transaction, which is rolled back,
+    so they can't lock rows, take values of sequences or notify. Other statements and selects,
+    which write by functions, are explained without ANALYZE, so they aren't run twice"""
+    try:
+        async with functions.pool().acquire() as conn:
+            plan = None
+            if trace.query.lstrip()[:6].upper() == 'SELECT':
+                transaction = conn.transaction(readonly=True)
+                await transaction.start()
+                try:
+                    plan = await conn.fetch(f'EXPLAIN (ANALYZE, BUFFERS) {trace.query}', 
+                                            *trace.args)
+                except asyncpg.ReadOnlySQLTransactionError:
+                    pass
+                finally:
+                    await transaction.rollback()
+            if plan is None:
+                plan = await conn.fetch(f'EXPLAIN {trace.query}', *trace.args)
+    except Exception as e:
+        debug_logger.warning('I can\'t explain %s: %s', normalize(trace.query), e)
+        return
+    debug_logger.warning('Slow statement %.1f ms: %s\n%s', trace.time*1e3,
+                         normalize(trace.query), '\n'.join(row[0] for row in plan))
+
+
+def report() -> str:
+    """Returns table of statements sorted by their total time"""
+    lines = [f'{"calls":>8} {"total s":>9} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} '
+             f'{"rows":>10} {"wait ms":>9}  statement']
+    for statement, stats in sorted(_stats.items(), key=lambda s: -s[1].time):
+        lines.append(f'{stats.calls:>8} {stats.time:>9.3f} '+
+                     ' '.join(f'{stats.percentile(p)*1e3:>9.3f}' for p in (50, 95, 99))+
+                     f' {stats.rows:>10} {stats.wait/stats.calls*1e3:>9.3f}  {statement[:120]}')
+    return '\n'.join(lines)
+
+def dump(path: str | None = None) -> str:
+    """Returns statistics as JSON with sorted keys, which can be diffed,
+    and writes them to path"""
+    output = json.dumps({
+        statement: {
+            'calls': stats.calls, 'errors': stats.errors, 'time': round(stats.time, 6),
+            'p50': stats.percentile(50), 'p95': stats.percentile(95), 'p99': stats.percentile(99),
+            'rows': stats.rows, 'wait': round(stats.wait, 6)
+        } for statement, stats in _stats.items()
+    }, indent=2, sort_keys=True)
+    if path:
+        with open(path, 'w') as file:
+            file.write(output)
+    return output